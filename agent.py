@@ -0,0 +1,92 @@
+import gzip
+import os
+import socket
+import time as t
+from datetime import datetime
+
+import requests
+import schedule
+from bson import json_util
+
+from cpu_columns import to_columnar
+from metric_writer import BufferedMetricWriter
+from sampler import MetricSampler
+
+# Lightweight per-host collector: samples like tiny_script.py but, instead of writing
+# to MongoDB, pushes gzip-compressed NDJSON batches to the central ingest endpoint
+# of record.py (POST /ingest/metrics)
+INGEST_URL = os.environ.get('INGEST_URL', 'http://127.0.0.1:5000/ingest/metrics')
+HOST_ID = os.environ.get('HOST_ID', socket.gethostname())
+
+SAMPLE_INTERVAL = 0.25  # in seconds
+PERSIST_INTERVAL_MINUTES = 1
+SPOOL_PATH = "agent.spool"
+REJECTED_PATH = "agent.rejected"  # Batches the ingest server refused, one document per line
+PUSH_BATCH_SIZE = 10
+PUSH_FLUSH_INTERVAL = 30  # in seconds
+PUSH_TIMEOUT = 10  # in seconds
+
+
+class HttpMetricSink:
+    """Stands in for a collection in BufferedMetricWriter: insert_many posts the batch
+    to the ingest endpoint and raises if it could not be delivered (connection error,
+    429 or 5xx), so the writer spools it. A batch the server refuses as invalid would be
+    refused again on every replay, it is moved to rejected_path instead."""
+
+    def __init__(self, url, timeout=PUSH_TIMEOUT, rejected_path=REJECTED_PATH):
+        self.url = url
+        self.timeout = timeout
+        self.rejected_path = rejected_path
+        self.session = requests.Session()  # Keeps the connection to the ingest server alive
+
+    def insert_many(self, documents, ordered=True):
+        body = '\n'.join(json_util.dumps(document) for document in documents).encode()
+        response = self.session.post(
+            self.url,
+            data=gzip.compress(body),
+            headers={'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'},
+            timeout=self.timeout
+        )
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        if response.status_code >= 400:
+            rejected = documents
+            if response.status_code == 422:
+                # The rest of the batch was stored, only the samples in errors were not
+                indexes = {error['index'] for error in response.json().get('errors', [])}
+                rejected = [document for i, document in enumerate(documents) if i in indexes]
+            print(f'The ingest server rejected {len(rejected)} samples ({response.status_code}), '
+                  f'moving them to {self.rejected_path}: {response.text[:200]}')
+            with open(self.rejected_path, 'a') as f:
+                for document in rejected:
+                    f.write(json_util.dumps(document))
+                    f.write('\n')
+
+
+def collect(sampler, writer):
+    window = sampler.drain()
+    if window is None:
+        return
+    status = {"timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "host": HOST_ID, **window}
+    writer.write(to_columnar(status))
+
+
+if __name__ == "__main__":
+    sampler = MetricSampler(SAMPLE_INTERVAL)
+    writer = BufferedMetricWriter(
+        HttpMetricSink(INGEST_URL),
+        SPOOL_PATH,
+        batch_size=PUSH_BATCH_SIZE,
+        flush_interval=PUSH_FLUSH_INTERVAL
+    )
+    print(f"Pushing samples of {HOST_ID} to {INGEST_URL}")
+
+    schedule.every(PERSIST_INTERVAL_MINUTES).minutes.do(collect, sampler, writer)
+
+    try:
+        while True:
+            schedule.run_pending()
+            t.sleep(1)
+    finally:
+        sampler.stop()
+        writer.close()
@@ -0,0 +1,141 @@
+import threading
+
+import numpy as np
+
+from cpu_columns import CPU_CORE_PREFIX, cpu_core_fields, cpu_core_index
+
+# Alerting over the stored samples. Every host has one row per sample in a ring
+# buffer with a column per field and per core, so each rule is evaluated for all
+# columns at once with NumPy:
+#   - threshold: the value reaches a static limit (RAM at 95%, a core pinned at 100%)
+#   - zscore: the value is more than Z_THRESHOLD standard deviations away from the
+#     mean of the last WINDOW samples
+#   - ewma: the value is more than EWMA_THRESHOLD deviations away from an
+#     exponentially weighted mean and variance, which react faster than the window
+# An alert is raised when a rule starts firing for a column, not on every sample
+# while it keeps firing.
+FIELDS = ['ram_usage_percent', 'disk_usage_percent', 'swap_usage_percent'] + cpu_core_fields()
+THRESHOLDS = {
+    'ram_usage_percent': 95,
+    'disk_usage_percent': 90,
+    'swap_usage_percent': 80,
+    CPU_CORE_PREFIX: 99  # Every cpu_core_N field, a per-minute mean this high is a pinned core
+}
+WINDOW = 60  # samples
+MIN_SAMPLES = 10  # The statistical rules stay quiet until a host has this many samples
+Z_THRESHOLD = 4.0
+EWMA_ALPHA = 0.1
+EWMA_THRESHOLD = 5.0
+MIN_DEVIATION = 2.0  # in percentage points, flat series do not alert on tiny moves
+RULES = ['threshold', 'zscore', 'ewma']
+
+
+def threshold_vector(fields, thresholds):
+    # Static limit of every column, NaN where there is none
+    limits = np.full(len(fields), np.nan)
+    for column, field in enumerate(fields):
+        key = CPU_CORE_PREFIX if cpu_core_index(field) is not None else field
+        if key in thresholds:
+            limits[column] = thresholds[key]
+    return limits
+
+
+class HostState:
+    def __init__(self, columns, window):
+        self.buffer = np.full((window, columns), np.nan)
+        self.position = 0
+        self.ewma_mean = np.full(columns, np.nan)
+        self.ewma_variance = np.zeros(columns)
+        self.active = np.zeros((len(RULES), columns), dtype=bool)
+
+
+class AnomalyDetector:
+    """Keeps the recent samples of every host and writes an alert document to
+    alerts_collection whenever a rule starts firing. add_samples takes stored sample
+    documents, so it can be used as a BufferedMetricWriter listener."""
+
+    def __init__(self, alerts_collection, source, fields=FIELDS, thresholds=THRESHOLDS, window=WINDOW,
+                 z_threshold=Z_THRESHOLD, ewma_alpha=EWMA_ALPHA, ewma_threshold=EWMA_THRESHOLD):
+        self.alerts_collection = alerts_collection
+        self.source = source  # Name of the collection the samples come from
+        self.fields = list(fields)
+        self.limits = threshold_vector(self.fields, thresholds)
+        self.window = window
+        self.z_threshold = z_threshold
+        self.ewma_alpha = ewma_alpha
+        self.ewma_threshold = ewma_threshold
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.alerts_collection.create_index([('collection', 1), ('timestamp', 1)])
+
+    def add_samples(self, documents):
+        alerts = []
+        with self.lock:
+            for document in sorted(documents, key=lambda document: document['timestamp']):
+                alerts.extend(self.add_sample(document))
+        if alerts:
+            for alert in alerts:
+                print(f"Alert on {alert['host']}: {alert['message']}")
+            self.alerts_collection.insert_many(alerts, ordered=False)
+        return alerts
+
+    def add_sample(self, document):
+        host = document.get('host')
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(len(self.fields), self.window)
+        values = np.array([document.get(field, np.nan) for field in self.fields], dtype=float)
+        present = ~np.isnan(values)
+
+        # Statistics of the samples before this one, so a spike does not hide itself
+        counts = np.sum(~np.isnan(state.buffer), axis=0)
+        warm = present & (counts >= MIN_SAMPLES)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(state.buffer, axis=0) / counts
+            std = np.sqrt(np.nansum((state.buffer - mean) ** 2, axis=0) / counts)
+            z = np.abs(values - mean) / np.maximum(std, MIN_DEVIATION / self.z_threshold)
+            deviation = values - state.ewma_mean
+            ewma_score = np.abs(deviation) / np.maximum(np.sqrt(state.ewma_variance), MIN_DEVIATION / self.ewma_threshold)
+            firing = np.array([
+                present & (values >= self.limits),
+                warm & (z > self.z_threshold),
+                warm & (ewma_score > self.ewma_threshold)
+            ])
+        scores = np.array([values, z, ewma_score])
+        limits = np.array([self.limits, np.full(len(self.fields), self.z_threshold), np.full(len(self.fields), self.ewma_threshold)])
+
+        # Raise on the rising edge only, a column without a value keeps its state
+        rising = firing & ~state.active
+        state.active = np.where(present, firing, state.active)
+
+        # Update the ring buffer and the exponentially weighted mean and variance
+        state.buffer[state.position] = values
+        state.position = (state.position + 1) % self.window
+        first = present & np.isnan(state.ewma_mean)
+        state.ewma_mean[first] = values[first]
+        update = present & ~first
+        alpha = self.ewma_alpha
+        state.ewma_mean[update] += alpha * deviation[update]
+        state.ewma_variance[update] = (1 - alpha) * (state.ewma_variance[update] + alpha * deviation[update] ** 2)
+
+        alerts = []
+        for rule, column in zip(*np.nonzero(rising)):
+            field = self.fields[column]
+            alert = {
+                'timestamp': document['timestamp'],
+                'collection': self.source,
+                'host': host,
+                'field': field,
+                'rule': RULES[rule],
+                'value': float(values[column]),
+                'score': float(scores[rule, column]),
+                'limit': float(limits[rule, column]),
+                'message': f"{field} at {values[column]:.1f} ({RULES[rule]} {scores[rule, column]:.1f}, limit {limits[rule, column]:.1f})"
+            }
+            if cpu_core_index(field) is not None:
+                alert['core'] = cpu_core_index(field)
+            alerts.append(alert)
+        return alerts
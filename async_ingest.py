@@ -0,0 +1,63 @@
+import asyncio
+import time as t
+
+
+def async_client_class():
+    # Imported only when async mode is selected, the threaded mode works with any PyMongo
+    try:
+        # PyMongo 4.9+ ships its own asyncio client
+        from pymongo import AsyncMongoClient
+        return AsyncMongoClient
+    except ImportError:
+        pass
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient
+    except ImportError:
+        raise ImportError("async mode needs PyMongo 4.9 or later, or Motor (pip install motor)") from None
+
+
+async def insert_tasks_async(uri, db_name, collection_name, k, max_in_flight=200, batch_size=1):
+    # Insert k "Automatic Task" documents from one event loop. At most max_in_flight
+    # inserts are awaiting the server at any time, batch_size > 1 groups consecutive
+    # tasks into one insert_many.
+    client = async_client_class()(uri, maxPoolSize=max_in_flight)
+    collection = client[db_name][collection_name]
+    semaphore = asyncio.Semaphore(max_in_flight)
+    pending = set()
+    failures = 0
+
+    async def insert(start, stop):
+        nonlocal failures
+        documents = [{'content': f"Automatic Task {i+1}"} for i in range(start, stop)]
+        try:
+            if len(documents) == 1:
+                await collection.insert_one(documents[0])
+            else:
+                await collection.insert_many(documents, ordered=False)
+        except Exception as e:
+            failures += 1
+            print(f'There was an issue adding tasks {start+1} to {stop}: {e}')
+
+    def done(task):
+        pending.discard(task)
+        semaphore.release()
+
+    start_time = t.time()
+    for start in range(0, k, batch_size):
+        # Wait for a free slot before creating the next insert, so memory stays bounded
+        await semaphore.acquire()
+        task = asyncio.create_task(insert(start, min(start + batch_size, k)))
+        pending.add(task)
+        task.add_done_callback(done)
+    await asyncio.gather(*pending)
+    total_duration = t.time() - start_time
+
+    close = client.close()
+    if asyncio.iscoroutine(close):
+        await close
+    return total_duration, failures
+
+
+def run_insert_tasks_async(uri, db_name, collection_name, k, max_in_flight=200, batch_size=1):
+    return asyncio.run(insert_tasks_async(uri, db_name, collection_name, k, max_in_flight, batch_size))
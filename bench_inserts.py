@@ -0,0 +1,220 @@
+import argparse
+import concurrent.futures
+import json
+import sqlite3
+import sys
+import time as t
+
+# Insert benchmark shared by the ressource.py / ressource_sql.py / old.py workloads:
+# the same "Automatic Task N" rows go to any backend, for every combination of batch
+# size, concurrency and commit granularity, and each run reports throughput and the
+# p50/p99 latency of a single insert call as JSON.
+
+
+def make_rows(start, stop):
+    return [{'content': f"Automatic Task {i+1}"} for i in range(start, stop)]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(int(round(q / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path, journal_mode=None):
+        self.path = path
+        self.journal_mode = journal_mode
+
+    def connect(self):
+        # One connection per worker, sqlite3 connections are not shared across threads
+        connection = sqlite3.connect(self.path, timeout=60)
+        if self.journal_mode:
+            connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        return connection
+
+    def setup(self):
+        connection = self.connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS todo (id INTEGER PRIMARY KEY, content VARCHAR(200) NOT NULL)")
+        connection.execute("DELETE FROM todo")
+        connection.commit()
+        connection.close()
+
+    def insert(self, connection, rows):
+        connection.executemany("INSERT INTO todo (content) VALUES (?)", [(row['content'],) for row in rows])
+
+    def commit(self, connection):
+        connection.commit()
+
+    def close(self, connection):
+        connection.commit()
+        connection.close()
+
+
+class MySQLBackend:
+    name = 'mysql'
+
+    def __init__(self):
+        from config import get_settings
+
+        _, self.config = get_settings()
+
+    def connect(self):
+        import mysql.connector
+
+        return mysql.connector.connect(**self.config)
+
+    def setup(self):
+        connection = self.connect()
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS todo (id INT AUTO_INCREMENT PRIMARY KEY, content VARCHAR(200) NOT NULL)")
+        cursor.execute("DELETE FROM todo")
+        connection.commit()
+        cursor.close()
+        connection.close()
+
+    def insert(self, connection, rows):
+        cursor = connection.cursor()
+        cursor.executemany("INSERT INTO todo (content) VALUES (%s)", [(row['content'],) for row in rows])
+        cursor.close()
+
+    def commit(self, connection):
+        connection.commit()
+
+    def close(self, connection):
+        connection.commit()
+        connection.close()
+
+
+class MongoBackend:
+    name = 'mongo'
+
+    def __init__(self, uri, mock=False):
+        if mock:
+            # In-memory stand-in for running the harness without a mongod
+            import mongomock
+
+            self.client = mongomock.MongoClient()
+            self.name = 'mongomock'
+        else:
+            from pymongo import MongoClient
+
+            self.client = MongoClient(uri)
+        self.collection = self.client['test_ressource']['bench']
+
+    def connect(self):
+        # MongoClient is thread-safe and pools its own connections
+        return self.collection
+
+    def setup(self):
+        self.collection.delete_many({})
+
+    def insert(self, collection, rows):
+        if len(rows) == 1:
+            collection.insert_one(rows[0])
+        else:
+            collection.insert_many(rows, ordered=False)
+
+    def commit(self, collection):
+        # Every Mongo write is durable on its own, commit granularity does not apply
+        pass
+
+    def close(self, collection):
+        pass
+
+
+def run_worker(backend, start, stop, batch_size, commit_rows):
+    connection = backend.connect()
+    latencies = []
+    uncommitted = 0
+    try:
+        for batch_start in range(start, stop, batch_size):
+            rows = make_rows(batch_start, min(batch_start + batch_size, stop))
+            op_start = t.perf_counter()
+            backend.insert(connection, rows)
+            uncommitted += len(rows)
+            if uncommitted >= commit_rows:
+                backend.commit(connection)
+                uncommitted = 0
+            latencies.append(t.perf_counter() - op_start)
+    finally:
+        backend.close(connection)
+    return latencies
+
+
+def run_benchmark(backend, rows, batch_size, concurrency, commit_rows):
+    backend.setup()
+    share = -(-rows // concurrency)
+    start_time = t.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(run_worker, backend, start, min(start + share, rows), batch_size, commit_rows)
+            for start in range(0, rows, share)
+        ]
+        latencies = sorted(latency for future in futures for latency in future.result())
+    duration = t.perf_counter() - start_time
+    return {
+        'backend': backend.name,
+        'rows': rows,
+        'batch_size': batch_size,
+        'concurrency': concurrency,
+        'commit_rows': commit_rows,
+        'seconds': duration,
+        'rows_per_second': rows / duration,
+        'ops': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+
+def make_backend(name, args):
+    if name == 'sqlite':
+        return SQLiteBackend(args.sqlite_path, args.sqlite_journal_mode)
+    if name == 'mongo':
+        return MongoBackend(args.mongo_uri)
+    if name == 'mongomock':
+        return MongoBackend(args.mongo_uri, mock=True)
+    if name == 'mysql':
+        return MySQLBackend()
+    raise ValueError(f"Unknown backend {name}")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bulk inserts across backends")
+    parser.add_argument('--backend', action='append', choices=['sqlite', 'mongo', 'mongomock', 'mysql'],
+                        help="backend to run, repeat for several (default: sqlite)")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--batch-sizes', type=int_list, default=[1, 100], help="rows per insert call, comma separated")
+    parser.add_argument('--concurrency', type=int_list, default=[1, 4], help="worker threads, comma separated")
+    parser.add_argument('--commit-rows', type=int_list, default=[1, 1000], help="rows per commit, comma separated")
+    parser.add_argument('--sqlite-path', default='bench.db')
+    parser.add_argument('--sqlite-journal-mode', default=None, help="e.g. WAL")
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.backend or ['sqlite']:
+        backend = make_backend(name, args)
+        for batch_size in args.batch_sizes:
+            for concurrency in args.concurrency:
+                for commit_rows in args.commit_rows:
+                    result = run_benchmark(backend, args.rows, batch_size, concurrency, commit_rows)
+                    print(f"{result['backend']} batch={batch_size} concurrency={concurrency} commit={commit_rows}: "
+                          f"{result['rows_per_second']:.0f} rows/s, p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms",
+                          file=sys.stderr)
+                    results.append(result)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
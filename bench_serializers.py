@@ -0,0 +1,117 @@
+import argparse
+import datetime
+import json
+import sys
+import time as t
+
+import bson
+from bson import ObjectId, json_util
+from flask import Flask, jsonify
+
+import serializers
+
+# Serialization benchmark for the /items responses: each path turns the same batch
+# of BSON documents, as the server sends it, into a JSON response body, and every
+# run reports the best of --repeat encodings and the size of the output as JSON.
+
+
+def make_documents(count):
+    created = datetime.datetime(2024, 1, 1)
+    return [
+        {
+            '_id': ObjectId(),
+            'name': 'example_item',
+            'value': 'example_value',
+            'n': i,
+            'tags': ['a', 'b'],
+            'nested': {'owner_id': ObjectId(), 'score': i * 0.5},
+            'created': created + datetime.timedelta(seconds=i)
+        }
+        for i in range(count)
+    ]
+
+
+# Previous path of record.py: copy every document with ObjectIds as strings, then
+# let jsonify walk the copy again
+def convert_to_json_serializable(doc):
+    if isinstance(doc, list):
+        return [convert_to_json_serializable(d) for d in doc]
+    elif isinstance(doc, dict):
+        return {k: convert_to_json_serializable(v) for k, v in doc.items()}
+    elif isinstance(doc, ObjectId):
+        return str(doc)
+    return doc
+
+
+def make_paths():
+    default_app = Flask('default')
+    bson_app = Flask('bson')
+    bson_app.json = serializers.BsonJSONProvider(bson_app)
+
+    # Cursors decode every document as it arrives
+    def convert_then_jsonify(raw):
+        with default_app.app_context():
+            return jsonify({'items': convert_to_json_serializable(bson.decode_all(raw))}).get_data()
+
+    def json_util_dumps(raw):
+        return json_util.dumps({'items': bson.decode_all(raw)}).encode()
+
+    def provider_jsonify(raw):
+        with bson_app.app_context():
+            return jsonify({'items': bson.decode_all(raw)}).get_data()
+
+    def lazy_raw_batch(raw):
+        # Decoding of the BSON batch happens inside the encoder's default hook
+        return serializers.to_json({'items': serializers.decode_raw_batch(raw)})
+
+    return {
+        'convert_then_jsonify': convert_then_jsonify,
+        'json_util': json_util_dumps,
+        'bson_provider': provider_jsonify,
+        'raw_bson_batch': lazy_raw_batch
+    }
+
+
+def run_benchmark(name, encode, raw, count, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = t.perf_counter()
+        output = encode(raw)
+        timings.append(t.perf_counter() - start_time)
+    return {
+        'path': name,
+        'encoder': 'orjson' if serializers.orjson is not None and name in ('bson_provider', 'raw_bson_batch') else 'json',
+        'documents': count,
+        'best_seconds': min(timings),
+        'documents_per_second': count / min(timings),
+        'bytes': len(output)
+    }
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON encoding of MongoDB documents")
+    parser.add_argument('--documents', type=int_list, default=[10000, 100000], help="response sizes, comma separated")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    paths = make_paths()
+    results = []
+    for count in args.documents:
+        raw = b''.join(bson.encode(document) for document in make_documents(count))
+        for name, encode in paths.items():
+            result = run_benchmark(name, encode, raw, count, args.repeat)
+            print(f"{name} {count} documents: {result['best_seconds'] * 1000:.1f} ms, "
+                  f"{result['documents_per_second']:.0f} documents/s", file=sys.stderr)
+            results.append(result)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
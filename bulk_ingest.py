@@ -0,0 +1,118 @@
+import concurrent.futures
+import gzip
+import queue
+import threading
+from collections.abc import Mapping
+
+from bson import ObjectId, json_util
+from bson.errors import InvalidBSON
+from flask import jsonify
+from pymongo.errors import BulkWriteError
+
+from serializers import decode_raw_batch
+
+# Bulk item ingest shared by the Flask apps (POST /items/bulk): the body is a JSON
+# array, NDJSON or concatenated BSON, split into chunks written with unordered insert_many by a few
+# writer threads. Requests are refused with 429 while the chunk queue is full.
+BULK_CHUNK_SIZE = 1000  # Documents per insert_many
+BULK_MAX_QUEUED_CHUNKS = 64
+BULK_WRITER_THREADS = 4
+BULK_RETRY_AFTER = 1  # in seconds, suggested to clients that got a 429
+BULK_WAIT_TIMEOUT = 60  # in seconds, how long a request waits for its chunks
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BulkWriter:
+    """Bounded queue of document chunks, written by writer threads. submit returns
+    one future per chunk, resolved to that chunk's result once it is written."""
+
+    def __init__(self, collection, chunk_size=BULK_CHUNK_SIZE, max_queued_chunks=BULK_MAX_QUEUED_CHUNKS, writers=BULK_WRITER_THREADS):
+        self.collection = collection
+        self.chunk_size = chunk_size
+        self.max_queued_chunks = max_queued_chunks
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(writers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, documents):
+        chunks = [documents[i:i + self.chunk_size] for i in range(0, len(documents), self.chunk_size)]
+        # A request is queued whole or not at all, so no client gets half written
+        with self.lock:
+            if self.queue.qsize() + len(chunks) > self.max_queued_chunks:
+                raise QueueFull()
+            futures = []
+            for number, chunk in enumerate(chunks):
+                future = concurrent.futures.Future()
+                self.queue.put((number * self.chunk_size, chunk, future))
+                futures.append(future)
+        return futures
+
+    def run(self):
+        while True:
+            offset, chunk, future = self.queue.get()
+            future.set_result(self.write(offset, chunk))
+
+    def write(self, offset, chunk):
+        result = {'offset': offset, 'count': len(chunk), 'inserted': len(chunk), 'errors': []}
+        try:
+            self.collection.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every document without an error of its own was still written
+            result['inserted'] = e.details.get('nInserted', 0)
+            result['errors'] = [
+                {'index': offset + error['index'], 'code': error.get('code'), 'message': error.get('errmsg')}
+                for error in e.details.get('writeErrors', [])
+            ]
+        except Exception as e:
+            print(f'There was an issue adding your items: {e}')
+            result['inserted'] = 0
+            result['errors'] = [{'index': None, 'code': None, 'message': str(e)}]
+        return result
+
+
+def parse_bulk_body(request):
+    # Documents of a JSON array, NDJSON or BSON body, optionally gzip-compressed
+    body = request.get_data()
+    if request.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    if request.mimetype == 'application/bson':
+        # Left encoded: insert_many sends raw documents as they are
+        return decode_raw_batch(body)
+    if request.mimetype == 'application/x-ndjson':
+        return [json_util.loads(line) for line in body.splitlines() if line.strip()]
+    documents = json_util.loads(body)
+    if not isinstance(documents, list):
+        raise ValueError('body must be a JSON array')
+    return documents
+
+
+def handle_bulk_request(bulk_writer, request):
+    try:
+        documents = parse_bulk_body(request)
+    except (OSError, ValueError, InvalidBSON):
+        return jsonify({'error': 'body must be a JSON array, one JSON document per line or BSON documents'}), 400
+    if not all(isinstance(document, Mapping) for document in documents):
+        return jsonify({'error': 'every item must be a JSON object'}), 400
+    # GET /items pages by _id, which only orders ids of one type
+    if any('_id' in document and not isinstance(document['_id'], ObjectId) for document in documents):
+        return jsonify({'error': 'an item _id must be an ObjectId, e.g. {"$oid": "..."}'}), 400
+    if len(documents) > bulk_writer.chunk_size * bulk_writer.max_queued_chunks:
+        return jsonify({'error': f'at most {bulk_writer.chunk_size * bulk_writer.max_queued_chunks} items per request'}), 413
+    if not documents:
+        return jsonify({'inserted': 0, 'chunks': []})
+
+    try:
+        futures = bulk_writer.submit(documents)
+    except QueueFull:
+        return jsonify({'error': 'write queue is full, retry later'}), 429, {'Retry-After': str(BULK_RETRY_AFTER)}
+
+    try:
+        chunks = [future.result(timeout=BULK_WAIT_TIMEOUT) for future in futures]
+    except concurrent.futures.TimeoutError:
+        return jsonify({'error': 'items were queued but are not all written yet'}), 504
+    return jsonify({'inserted': sum(chunk['inserted'] for chunk in chunks), 'chunks': chunks})
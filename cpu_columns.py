@@ -0,0 +1,44 @@
+import re
+
+# Per-core CPU usage is stored as one numeric field per core (cpu_core_0, cpu_core_1, ...)
+# so readers can slice it as a fixed-width matrix instead of unpacking nested lists
+CPU_CORE_PREFIX = 'cpu_core_'
+CPU_CORE_COUNT_FIELD = 'cpu_core_count'
+MAX_CPU_CORES = 256  # Upper bound used when projecting the core fields out of MongoDB
+
+CPU_CORE_PATTERN = re.compile(rf'^{CPU_CORE_PREFIX}(\d+)$')
+
+
+def cpu_core_field(core):
+    return f"{CPU_CORE_PREFIX}{core}"
+
+
+def cpu_core_fields(core_count=MAX_CPU_CORES):
+    return [cpu_core_field(core) for core in range(core_count)]
+
+
+def cpu_core_index(field):
+    # Core number of a cpu_core_N field, None for any other field
+    match = CPU_CORE_PATTERN.match(str(field))
+    return int(match.group(1)) if match else None
+
+
+def cpu_core_columns(columns):
+    # The cpu_core_N columns present, ordered by core number
+    cores = [(cpu_core_index(column), column) for column in columns]
+    return [column for core, column in sorted((c for c in cores if c[0] is not None), key=lambda c: c[0])]
+
+
+def to_columnar(status):
+    # Replace the nested cpu_usage_per_core list, and its _min/_max companions from
+    # the sampler, with one field per core (cpu_core_N, cpu_core_N_min, cpu_core_N_max)
+    document = {}
+    for field, value in status.items():
+        if field.startswith('cpu_usage_per_core'):
+            suffix = field[len('cpu_usage_per_core'):]
+            for core, usage in enumerate(value):
+                document[f"{cpu_core_field(core)}{suffix}"] = usage
+        else:
+            document[field] = value
+    document[CPU_CORE_COUNT_FIELD] = len(status.get('cpu_usage_per_core', []))
+    return document
@@ -1,21 +1,45 @@
 import pandas as pd
 import plotly.express as px
-from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
+import plotly.graph_objects as go
+from dash import Dash, dcc, html, ctx, no_update
+from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
 from pymongo import MongoClient
 import datetime
+import threading
+
+from cpu_columns import cpu_core_columns, cpu_core_field, cpu_core_fields, cpu_core_index
+from downsample import downsample_frame, downsample_series
+from query_cache import make_query_cache
+from request_stats import LatencyHistogram
+from rollup import ROLLUP_TIERS, rollup_collection_name
 
 # MongoDB connection details
 MONGO_URI = "mongodb://localhost:27017/"  # Change this if your MongoDB server is running on a different host/port
 DB_NAME = "test_ressource"
 COLLECTION_NAME = "ram"
+METRICS_COLLECTION_NAME = "metrics"  # Request metrics written by record.py
+HOST_METRICS_COLLECTION_NAME = "host_metrics"  # Samples pushed by agent.py to record.py
+ALERTS_COLLECTION_NAME = "alerts"  # Written by anomaly.py, from tiny_script.py and record.py
+FLEET = '__fleet__'  # host-selector value for the aggregate of every host
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'  # Format used by tiny_script.py when storing samples
+CACHE_RETENTION = datetime.timedelta(hours=48)  # How much recent history the live cache keeps in memory
+MIN_POINTS = 300  # A rollup tier is only used if it still gives this many points across the range
+RAW_SAMPLE_SECONDS = 60  # tiny_script.py stores one sample per minute
+MIN_TARGET_POINTS = 200  # Figures keep about one point per pixel of graph width, but never fewer than this
+LIVE_MAX_POINTS = 5000  # Live tail appends stop growing a trace past this many points
+REFRESH_SECONDS = 5  # interval-component period, results that are not invalidated on new samples live this long
 logo = '/assets/logo-deeperincode.svg'
 
 # Connect to MongoDB
 client = MongoClient(MONGO_URI)
 db = client[DB_NAME]
 collection = db[COLLECTION_NAME]
+metrics_collection = db[METRICS_COLLECTION_NAME]
+rollup_collections = {tier: db[rollup_collection_name(COLLECTION_NAME, tier)] for tier in ROLLUP_TIERS}
+host_metrics_collection = db[HOST_METRICS_COLLECTION_NAME]
+alerts_collection = db[ALERTS_COLLECTION_NAME]
+host_rollup_collections = {tier: db[rollup_collection_name(HOST_METRICS_COLLECTION_NAME, tier)] for tier in ROLLUP_TIERS}
 
 # OCR extracted details
 company_name = "Deeperincode"
@@ -36,6 +60,13 @@ app.layout = dbc.Container([
             'padding-top': '30px'  # Adjust as needed to align with logo
         }))
     ]),
+    dbc.Row([
+        dbc.Col(dcc.Dropdown(
+            id='host-selector',
+            options=[],
+            placeholder="Local collector"
+        ), md=4)
+    ]),
     dbc.Row([
         dbc.Col(dcc.DatePickerRange(
             id='date-range-picker',
@@ -101,9 +132,27 @@ app.layout = dbc.Container([
             placeholder="Select CPU Cores"
         ), md=6)
     ]),
+    dbc.Row([
+        dbc.Col(dcc.Graph(id='latency-percentile-graph', style={'overflowX': 'scroll'}), md=12)
+    ]),
+    dbc.Row([
+        dbc.Col(dcc.Dropdown(
+            id='route-selector',
+            options=[],
+            multi=True,
+            placeholder="Select Routes"
+        ), md=6)
+    ]),
+    # Browser width, to size the downsampling, and the range zoomed to on the graphs
+    dcc.Store(id='viewport-width'),
+    dcc.Store(id='zoom-range'),
+    # Selected data, shared by the graph callbacks, and what the figures currently
+    # show, for the live tail to append to
+    dcc.Store(id='data-key'),
+    dcc.Store(id='live-tail'),
     dcc.Interval(
         id='interval-component',
-        interval=5*1000,  # in milliseconds
+        interval=REFRESH_SECONDS*1000,  # in milliseconds
         n_intervals=0
     ),
 
@@ -130,18 +179,228 @@ app.layout = dbc.Container([
 ])
 
 
-def fetch_data_from_mongodb():
-    data = list(collection.find())
-    for item in data:
-        item['_id'] = str(item['_id'])  # Convert ObjectId to string if needed
-    return pd.DataFrame(data)
+# Fields each graph needs, everything else stays on the server.
+# cpu_usage_per_core is only present on documents stored before the per-core fields.
+GRAPH_FIELDS = [
+    'timestamp',
+    'cpu_usage_per_core',
+    'ram_used', 'ram_free',
+    'disk_used', 'disk_free',
+    'swap_used', 'swap_free'
+] + cpu_core_fields()
+
+
+def fetch_data_from_mongodb(start_datetime, end_datetime, fields=GRAPH_FIELDS, source=collection, match=None):
+    # Timestamps are stored as zero-padded strings, so a string range on the
+    # indexed field matches the chronological range
+    query = {'timestamp': {
+        '$gte': start_datetime.strftime(TIMESTAMP_FORMAT),
+        '$lte': end_datetime.strftime(TIMESTAMP_FORMAT)
+    }}
+    query.update(match or {})
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+    data = list(source.find(query, projection).sort('timestamp', 1))
+    return pd.DataFrame(data, columns=fields)
+
+
+# Fleet view: byte counters are summed across hosts, per-core CPU usage is averaged
+FLEET_SUM_FIELDS = ['ram_used', 'ram_free', 'disk_used', 'disk_free', 'swap_used', 'swap_free']
+FLEET_AVG_FIELDS = cpu_core_fields()
+
+
+def fetch_fleet_data(start_datetime, end_datetime, source=host_metrics_collection):
+    # Computed by MongoDB: each host's samples are first averaged per minute, so hosts
+    # sampling at different seconds line up, then the hosts are combined per minute
+    fields = FLEET_SUM_FIELDS + FLEET_AVG_FIELDS
+    pipeline = [
+        {'$match': {'timestamp': {
+            '$gte': start_datetime.strftime(TIMESTAMP_FORMAT),
+            '$lte': end_datetime.strftime(TIMESTAMP_FORMAT)
+        }}},
+        {'$group': {
+            '_id': {'minute': {'$substrBytes': ['$timestamp', 0, 16]}, 'host': '$host'},
+            **{field: {'$avg': f'${field}'} for field in fields}
+        }},
+        {'$group': {
+            '_id': '$_id.minute',
+            **{field: {'$sum': f'${field}'} for field in FLEET_SUM_FIELDS},
+            **{field: {'$avg': f'${field}'} for field in FLEET_AVG_FIELDS}
+        }},
+        {'$sort': {'_id': 1}},
+        {'$project': {'_id': 0, 'timestamp': {'$concat': ['$_id', ':00']}, **{field: 1 for field in fields}}}
+    ]
+    data = list(source.aggregate(pipeline, allowDiskUse=True))
+    return pd.DataFrame(data, columns=['timestamp'] + fields)
+
+
+def fetch_new_samples(after_timestamp, fields=GRAPH_FIELDS):
+    # Only documents stored after the last one we have already seen
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+    data = list(collection.find({'timestamp': {'$gt': after_timestamp}}, projection).sort('timestamp', 1))
+    return pd.DataFrame(data, columns=fields)
+
+
+def spread_legacy_cpu_usage(df):
+    # Turn the nested per-core lists of older documents into cpu_core_N columns
+    legacy = df['cpu_usage_per_core'].dropna()
+    if not legacy.empty:
+        per_core = pd.DataFrame(legacy.tolist(), index=legacy.index, dtype=float)
+        for core in per_core.columns:
+            field = cpu_core_field(core)
+            df[field] = df[field].astype(float).fillna(per_core[core]) if field in df else per_core[core]
+    return df.drop(columns='cpu_usage_per_core')
+
+
+def index_by_timestamp(df):
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    if 'cpu_usage_per_core' in df:
+        df = spread_legacy_cpu_usage(df)
+    # Keep only the cores this host actually has
+    df = df.drop(columns=[column for column in cpu_core_columns(df.columns) if df[column].isna().all()])
+    return df.set_index('timestamp')
+
+
+# Process-wide cache of the most recent samples, indexed by timestamp.
+# Each refresh only pulls the documents newer than the last cached one.
+cache_lock = threading.Lock()
+cache_df = None
+cache_last_timestamp = None
+cache_start = None
+
+# Query results shared by every session, and with QUERY_CACHE_BACKEND=sqlite by every
+# worker process: viewers of the same range cost one MongoDB query, not one each
+query_cache = make_query_cache()
+
+
+def refresh_cache():
+    global cache_df, cache_last_timestamp, cache_start
+    now = datetime.datetime.now()
+    retention_start = now - CACHE_RETENTION
+
+    if cache_df is None:
+        new_rows = fetch_data_from_mongodb(retention_start, now)
+    else:
+        new_rows = fetch_new_samples(cache_last_timestamp)
+
+    if not new_rows.empty:
+        if cache_df is not None:
+            # Cached results reaching past the first new sample no longer show everything
+            query_cache.invalidate(None, pd.to_datetime(new_rows['timestamp'].iloc[0]).isoformat())
+        cache_last_timestamp = new_rows['timestamp'].iloc[-1]
+    elif cache_last_timestamp is None:
+        cache_last_timestamp = retention_start.strftime(TIMESTAMP_FORMAT)
+
+    new_rows = index_by_timestamp(new_rows)
+    if cache_df is None or cache_df.empty:
+        cache_df = new_rows
+    elif not new_rows.empty:
+        cache_df = pd.concat([cache_df, new_rows])
+
+    # Evict samples that fell out of the retention window
+    cache_df = cache_df[cache_df.index >= retention_start]
+    cache_start = retention_start
+
+
+def get_samples(start_datetime, end_datetime):
+    with cache_lock:
+        refresh_cache()
+        if start_datetime >= cache_start:
+            return cache_df.loc[start_datetime:end_datetime].reset_index()
+
+    # Older ranges than the cache holds go straight to MongoDB
+    return index_by_timestamp(fetch_data_from_mongodb(start_datetime, end_datetime)).reset_index()
+
+
+def select_tier(start_datetime, end_datetime):
+    # Coarsest rollup tier that still gives MIN_POINTS buckets, None means raw samples
+    range_seconds = (end_datetime - start_datetime).total_seconds()
+    for tier, seconds in sorted(ROLLUP_TIERS.items(), key=lambda item: item[1], reverse=True):
+        # Tiers no coarser than the raw samples would only lose the cached tail
+        if seconds > RAW_SAMPLE_SECONDS and range_seconds / seconds >= MIN_POINTS:
+            return tier
+    return None
+
+
+def get_data(start_datetime, end_datetime, host=None):
+    # host is None for the local collector, a host id pushed by agent.py, or FLEET
+    tier = select_tier(start_datetime, end_datetime)
+    if host is None:
+        if tier is None:
+            return get_samples(start_datetime, end_datetime)
+        # Rollup documents store the bucket mean under the raw field names
+        df = fetch_data_from_mongodb(start_datetime, end_datetime, source=rollup_collections[tier])
+    else:
+        source = host_metrics_collection if tier is None else host_rollup_collections[tier]
+        if host == FLEET:
+            df = fetch_fleet_data(start_datetime, end_datetime, source=source)
+        else:
+            df = fetch_data_from_mongodb(start_datetime, end_datetime, source=source, match={'host': host})
+    return index_by_timestamp(df).reset_index()
+
+
+def host_options():
+    # distinct is answered from the (host, timestamp) index
+    hosts = sorted(host_metrics_collection.distinct('host'))
+    options = [{'label': 'Fleet (all hosts)', 'value': FLEET}] if hosts else []
+    return options + [{'label': host, 'value': host} for host in hosts]
+
+
+def resolve_range(start_date, end_date, start_hour, start_minute, end_hour, end_minute):
+    # Resolve the selected date and time range, the filtering itself runs in MongoDB
+    if start_date and end_date:
+        start_datetime = pd.to_datetime(start_date) + datetime.timedelta(hours=start_hour, minutes=start_minute)
+        end_datetime = pd.to_datetime(end_date) + datetime.timedelta(hours=end_hour, minutes=end_minute)
+    else:
+        end_datetime = datetime.datetime.now()
+        start_datetime = end_datetime - datetime.timedelta(hours=2)
+    return start_datetime, end_datetime
+
+
+def latency_percentiles(start_datetime, end_datetime, selected_routes):
+    # Merge the stored per-route histograms of every metrics interval in the range,
+    # per interval for the graph and over the whole range for the title
+    metrics = fetch_data_from_mongodb(start_datetime, end_datetime, fields=['timestamp', 'source', 'routes'], source=metrics_collection)
+    intervals = {}
+    routes = set()
+    overall = LatencyHistogram()
+    for timestamp, source, interval_routes in zip(metrics['timestamp'], metrics['source'], metrics['routes']):
+        if not isinstance(interval_routes, list):
+            continue
+        # Client-side latencies of loadgen.py are separate routes, left out unless selected
+        prefix = f"{source}: " if isinstance(source, str) else ''
+        # Every record.py worker stores its own document for the same minute
+        histogram = intervals.setdefault(timestamp[:16], LatencyHistogram())
+        for route in interval_routes:
+            if 'histogram' not in route:
+                continue
+            label = f"{prefix}{route['method']} {route['path']}"
+            routes.add(label)
+            if selected_routes:
+                include = label in selected_routes
+            else:
+                include = not prefix
+            if include:
+                histogram.merge(LatencyHistogram.from_document(route['histogram']))
+    rows = []
+    for minute, histogram in intervals.items():
+        if histogram.total():
+            overall.merge(histogram)
+            rows.append({
+                'timestamp': minute + ':00',
+                'p50': histogram.percentile(50) * 1000,
+                'p95': histogram.percentile(95) * 1000,
+                'p99': histogram.percentile(99) * 1000
+            })
+    df = pd.DataFrame(rows, columns=['timestamp', 'p50', 'p95', 'p99'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df, overall, sorted(routes)
+
 
 @app.callback(
-    Output('ram-usage-graph', 'figure'),
-    Output('storage-usage-graph', 'figure'),
-    Output('cpu-usage-graph', 'figure'),
-    Output('swap-usage-graph', 'figure'),
-    Output('core-selector', 'options'),
+    Output('latency-percentile-graph', 'figure'),
+    Output('route-selector', 'options'),
     Input('date-range-picker', 'start_date'),
     Input('date-range-picker', 'end_date'),
     Input('start-hour', 'value'),
@@ -149,50 +408,344 @@ def fetch_data_from_mongodb():
     Input('end-hour', 'value'),
     Input('end-minute', 'value'),
     Input('interval-component', 'n_intervals'),
-    Input('core-selector', 'value')
+    Input('route-selector', 'value')
 )
-def update_graph(start_date, end_date, start_hour, start_minute, end_hour, end_minute, n, selected_cores):
-    df = fetch_data_from_mongodb()
+def update_latency_graph(start_date, end_date, start_hour, start_minute, end_hour, end_minute, n, selected_routes):
+    start_datetime, end_datetime = resolve_range(start_date, end_date, start_hour, start_minute, end_hour, end_minute)
+    key = f"latency|{start_datetime.isoformat()}|{end_datetime.isoformat()}|{sorted(selected_routes or [])}"
+    df, overall, routes = query_cache.get_or_compute(
+        key,
+        lambda: latency_percentiles(start_datetime, end_datetime, selected_routes),
+        ttl=REFRESH_SECONDS
+    )
+
+    title = 'Request Latency Percentiles Over Time'
+    if overall.total():
+        title += (f" (range p50 {overall.percentile(50) * 1000:.1f} ms,"
+                  f" p95 {overall.percentile(95) * 1000:.1f} ms,"
+                  f" p99 {overall.percentile(99) * 1000:.1f} ms)")
+
+    fig_latency = px.line(df, x='timestamp', y=['p50', 'p95', 'p99'], title=title, labels={'value': 'Latency (ms)'})
+    fig_latency.update_layout(xaxis={'rangeslider': {'visible': True}})
+
+    route_options = [{'label': route, 'value': route} for route in routes]
+    return fig_latency, route_options
+
+
+def normalize_range(start_datetime, end_datetime):
+    # Widen the range to whole buckets of the tier it reads, so sessions asking for
+    # nearly the same range share one cache entry
+    tier = select_tier(start_datetime, end_datetime)
+    width = f'{ROLLUP_TIERS[tier] if tier else RAW_SAMPLE_SECONDS}s'
+    return pd.Timestamp(start_datetime).floor(width), pd.Timestamp(end_datetime).ceil(width), tier
+
+
+def get_frame(data_key):
+    host = data_key['host']
+    key = f"frame|{host}|{data_key['tier']}|{data_key['start']}|{data_key['end']}"
+    return query_cache.get_or_compute(
+        key,
+        lambda: get_data(pd.to_datetime(data_key['start']), pd.to_datetime(data_key['end']), host),
+        # The fleet aggregate is never invalidated, it only lives for one refresh
+        ttl=REFRESH_SECONDS if host == FLEET else None,
+        tag=host,
+        end=data_key['end']
+    )
+
+
+def fetch_alerts(data_key):
+    # Alerts raised on the samples of the selected host, over the selected range
+    host = data_key['host']
+    match = {'collection': COLLECTION_NAME if host is None else HOST_METRICS_COLLECTION_NAME}
+    if host not in (None, FLEET):
+        match['host'] = host
+    fields = ['timestamp', 'host', 'field', 'value', 'message']
+    df = fetch_data_from_mongodb(pd.to_datetime(data_key['start']), pd.to_datetime(data_key['end']),
+                                 fields=fields, source=alerts_collection, match=match)
     df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df
 
-    # Filter data based on selected date and time range
-    if start_date and end_date:
-        start_datetime = pd.to_datetime(start_date) + datetime.timedelta(hours=start_hour, minutes=start_minute)
-        end_datetime = pd.to_datetime(end_date) + datetime.timedelta(hours=end_hour, minutes=end_minute)
-        df = df[(df['timestamp'] >= start_datetime) & (df['timestamp'] <= end_datetime)]
-    else:
-        df = df[(df['timestamp'] >= (datetime.datetime.now() - datetime.timedelta(hours=2)))]
 
-    # Flatten nested lists for CPU usage
-    df_long = df.explode('cpu_usage_per_core').reset_index(drop=True)
-    df_long['core'] = df_long.groupby(['timestamp']).cumcount()
-    df_long.rename(columns={'cpu_usage_per_core': 'cpu_usage_core'}, inplace=True)
+def add_alert_markers(fig, data_key, fields, df=None, y_column=None):
+    # One marker per alert on any of fields. Alerts on a percentage drawn over a
+    # graph in bytes sit on the plotted y_column at the time of the alert.
+    alerts = query_cache.get_or_compute(
+        f"alerts|{data_key['host']}|{data_key['start']}|{data_key['end']}",
+        lambda: fetch_alerts(data_key),
+        ttl=REFRESH_SECONDS
+    )
+    alerts = alerts[alerts['field'].isin(fields)]
+    if alerts.empty:
+        return fig
+    y = alerts['value']
+    if y_column is not None and not df.empty:
+        nearest = pd.merge_asof(alerts[['timestamp']], df[['timestamp', y_column]], on='timestamp', direction='nearest')
+        y = nearest[y_column].values
+    text = alerts['message'] if data_key['host'] != FLEET else alerts['host'] + ': ' + alerts['message']
+    fig.add_scatter(x=alerts['timestamp'], y=y, mode='markers', name='alerts', text=text, hoverinfo='text+x',
+                    marker={'symbol': 'x', 'size': 10, 'color': 'red'})
+    return fig
 
-    # Get unique cores
-    unique_cores = df_long['core'].unique().tolist()
-    core_options = [{'label': f'Core {i}', 'value': i} for i in unique_cores]
 
-    # Filter data based on selected cores
-    if selected_cores:
-        df_long = df_long[df_long['core'].isin(selected_cores)]
+def target_points(viewport_width):
+    # Graphs take half of the page width, keep about one point per pixel
+    return max((viewport_width or 0) // 2, MIN_TARGET_POINTS)
+
 
-    # RAM Usage
+@app.callback(
+    Output('data-key', 'data'),
+    Output('live-tail', 'data'),
+    Input('date-range-picker', 'start_date'),
+    Input('date-range-picker', 'end_date'),
+    Input('start-hour', 'value'),
+    Input('start-minute', 'value'),
+    Input('end-hour', 'value'),
+    Input('end-minute', 'value'),
+    Input('host-selector', 'value'),
+    Input('zoom-range', 'data')
+)
+def select_data(start_date, end_date, start_hour, start_minute, end_hour, end_minute, selected_host, zoom_range):
+    # Resolves the selection once, every graph callback reads the frame it names.
+    # Interval ticks do not come here, they go through extend_graphs.
+    start_datetime, end_datetime = resolve_range(start_date, end_date, start_hour, start_minute, end_hour, end_minute)
+
+    # Zooming in fetches the zoomed window only, at the finer detail it allows
+    if zoom_range:
+        start_datetime = max(start_datetime, pd.to_datetime(zoom_range[0]))
+        end_datetime = min(end_datetime, pd.to_datetime(zoom_range[1]))
+    start_datetime, end_datetime, tier = normalize_range(start_datetime, end_datetime)
+
+    data_key = {
+        'start': start_datetime.isoformat(),
+        'end': end_datetime.isoformat(),
+        'host': selected_host,
+        'tier': tier,
+        # Keeps the user's zoom across refreshes until the selection changes
+        'ui_revision': f"{start_date} {end_date} {start_hour} {start_minute} {end_hour} {end_minute} {selected_host}"
+    }
+    df = get_frame(data_key)
+
+    # New samples can be appended as they are when the figures show raw samples up to now
+    live = (
+        not zoom_range
+        and selected_host != FLEET
+        and tier is None
+        and end_datetime >= datetime.datetime.now()
+    )
+    live_tail = {
+        'live': live,
+        'host': selected_host,
+        'end': end_datetime.isoformat(),
+        'last_timestamp': (df['timestamp'].max() if not df.empty else start_datetime).isoformat(),
+        'cores': [cpu_core_index(c) for c in cpu_core_columns(df.columns)]
+    }
+    return data_key, live_tail
+
+
+@app.callback(
+    Output('ram-usage-graph', 'figure'),
+    Input('data-key', 'data'),
+    Input('viewport-width', 'data')
+)
+def update_ram_graph(data_key, viewport_width):
+    df = downsample_frame(get_frame(data_key), ['ram_used', 'ram_free'], target_points(viewport_width))
     fig_ram = px.bar(df, x='timestamp', y=['ram_used', 'ram_free'], title='RAM Usage Over Time', labels={'value': 'Bytes'})
-    fig_ram.update_layout(xaxis={'rangeslider': {'visible': True}})
+    fig_ram.update_layout(xaxis={'rangeslider': {'visible': True}}, uirevision=data_key['ui_revision'])
+    add_alert_markers(fig_ram, data_key, ['ram_usage_percent'], df, 'ram_used')
+    return fig_ram
 
-    # Storage Usage
+
+@app.callback(
+    Output('storage-usage-graph', 'figure'),
+    Input('data-key', 'data'),
+    Input('viewport-width', 'data')
+)
+def update_storage_graph(data_key, viewport_width):
+    df = downsample_frame(get_frame(data_key), ['disk_used', 'disk_free'], target_points(viewport_width))
     fig_storage = px.bar(df, x='timestamp', y=['disk_used', 'disk_free'], title='Storage Usage Over Time', labels={'value': 'Bytes'})
-    fig_storage.update_layout(xaxis={'rangeslider': {'visible': True}})
+    fig_storage.update_layout(xaxis={'rangeslider': {'visible': True}}, uirevision=data_key['ui_revision'])
+    add_alert_markers(fig_storage, data_key, ['disk_usage_percent'], df, 'disk_used')
+    return fig_storage
+
+
+def selected_core_columns(df, selected_cores):
+    # Per-core CPU usage is a timestamp x core matrix of cpu_core_N columns
+    core_columns = cpu_core_columns(df.columns)
+    if selected_cores:
+        core_columns = [c for c in core_columns if cpu_core_index(c) in selected_cores]
+    return core_columns
+
+
+@app.callback(
+    Output('cpu-usage-graph', 'figure'),
+    Input('data-key', 'data'),
+    Input('viewport-width', 'data'),
+    Input('core-selector', 'value')
+)
+def update_cpu_graph(data_key, viewport_width, selected_cores):
+    df = get_frame(data_key)
+    core_columns = selected_core_columns(df, selected_cores)
+    # Each core is downsampled on its own, so every trace keeps about one point per pixel
+    series = downsample_series(df, core_columns, target_points(viewport_width))
+    fig_cpu = go.Figure([
+        go.Scatter(x=x, y=y, mode='lines', name=str(cpu_core_index(column)))
+        for column, (x, y) in series.items()
+    ])
+    fig_cpu.update_layout(
+        title='CPU Core Usage Over Time',
+        yaxis_title='CPU Usage (%)',
+        xaxis_title='timestamp',
+        legend_title_text='core',
+        xaxis={'rangeslider': {'visible': True}},
+        uirevision=data_key['ui_revision']
+    )
+    add_alert_markers(fig_cpu, data_key, core_columns)
+    return fig_cpu
 
-    # CPU Core Usage
-    fig_cpu = px.line(df_long, x='timestamp', y='cpu_usage_core', color='core', title='CPU Core Usage Over Time', labels={'cpu_usage_core': 'CPU Usage (%)'})
-    fig_cpu.update_layout(xaxis={'rangeslider': {'visible': True}})
 
-    # Swap Usage
+@app.callback(
+    Output('swap-usage-graph', 'figure'),
+    Input('data-key', 'data'),
+    Input('viewport-width', 'data')
+)
+def update_swap_graph(data_key, viewport_width):
+    df = downsample_frame(get_frame(data_key), ['swap_used', 'swap_free'], target_points(viewport_width))
     fig_swap = px.line(df, x='timestamp', y=['swap_used', 'swap_free'], title='Swap Usage Over Time', labels={'value': 'Bytes'})
-    fig_swap.update_layout(xaxis={'rangeslider': {'visible': True}})
+    fig_swap.update_layout(xaxis={'rangeslider': {'visible': True}}, uirevision=data_key['ui_revision'])
+    add_alert_markers(fig_swap, data_key, ['swap_usage_percent'], df, 'swap_used')
+    return fig_swap
+
 
-    return fig_ram, fig_storage, fig_cpu, fig_swap, core_options
+@app.callback(
+    Output('core-selector', 'options'),
+    Input('data-key', 'data')
+)
+def update_core_options(data_key):
+    core_columns = cpu_core_columns(get_frame(data_key).columns)
+    return [{'label': f'Core {cpu_core_index(c)}', 'value': cpu_core_index(c)} for c in core_columns]
+
+
+@app.callback(
+    Output('host-selector', 'options'),
+    Input('data-key', 'data')
+)
+def update_host_options(data_key):
+    return host_options()
+
+
+def get_host_tail(host, after, end_datetime):
+    # Sessions following the same host ask for the same new samples on each tick
+    def fetch():
+        match = {'host': host}
+        df = index_by_timestamp(fetch_data_from_mongodb(after, end_datetime, source=host_metrics_collection, match=match)).reset_index()
+        df = df[df['timestamp'] >= after]
+        if not df.empty:
+            query_cache.invalidate(host, df['timestamp'].iloc[0].isoformat())
+        return df
+
+    key = f"tail|{host}|{after.isoformat()}|{end_datetime.isoformat()}"
+    return query_cache.get_or_compute(key, fetch, ttl=REFRESH_SECONDS)
+
+
+def extend_args(df, columns):
+    # extendData payload appending df's rows to the traces drawn from columns, in order
+    x = df['timestamp'].astype(str).tolist()
+    y = [df[column].tolist() if column in df else [None] * len(df) for column in columns]
+    return dict(x=[x] * len(columns), y=y), list(range(len(columns))), LIVE_MAX_POINTS
+
+
+@app.callback(
+    Output('ram-usage-graph', 'extendData'),
+    Output('storage-usage-graph', 'extendData'),
+    Output('cpu-usage-graph', 'extendData'),
+    Output('swap-usage-graph', 'extendData'),
+    Output('live-tail', 'data', allow_duplicate=True),
+    Input('interval-component', 'n_intervals'),
+    State('live-tail', 'data'),
+    State('core-selector', 'value'),
+    prevent_initial_call=True
+)
+def extend_graphs(n, live_tail, selected_cores):
+    # Live tail: append only the samples stored since the last tick
+    if not live_tail or not live_tail['live']:
+        return no_update, no_update, no_update, no_update, no_update
+
+    after = pd.to_datetime(live_tail['last_timestamp']) + datetime.timedelta(microseconds=1)
+    end_datetime = pd.to_datetime(live_tail['end'])
+    if live_tail['host'] is None:
+        df = get_samples(after, end_datetime)
+    else:
+        df = get_host_tail(live_tail['host'], after, end_datetime)
+    if df.empty:
+        return no_update, no_update, no_update, no_update, no_update
+
+    # Same trace order as update_cpu_graph
+    cores = [core for core in live_tail['cores'] if not selected_cores or core in selected_cores]
+    cpu_extend = extend_args(df, [cpu_core_field(core) for core in cores]) if cores else no_update
+    live_tail = dict(live_tail, last_timestamp=df['timestamp'].iloc[-1].isoformat())
+    return (
+        extend_args(df, ['ram_used', 'ram_free']),
+        extend_args(df, ['disk_used', 'disk_free']),
+        cpu_extend,
+        extend_args(df, ['swap_used', 'swap_free']),
+        live_tail
+    )
+
+
+# Viewport width from the browser, only sent when it changed
+app.clientside_callback(
+    """
+    function(n, current) {
+        var width = window.innerWidth;
+        return width === current ? window.dash_clientside.no_update : width;
+    }
+    """,
+    Output('viewport-width', 'data'),
+    Input('interval-component', 'n_intervals'),
+    State('viewport-width', 'data')
+)
+
+
+def relayout_range(relayout_data):
+    # x range of a zoom or range slider move, None when zoomed back out,
+    # no_update for relayouts that do not touch the x axis
+    if not relayout_data:
+        return no_update
+    if relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data:
+        return [relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']]
+    if 'xaxis.range' in relayout_data:
+        return list(relayout_data['xaxis.range'])
+    return no_update
+
+
+@app.callback(
+    Output('zoom-range', 'data'),
+    Input('ram-usage-graph', 'relayoutData'),
+    Input('storage-usage-graph', 'relayoutData'),
+    Input('cpu-usage-graph', 'relayoutData'),
+    Input('swap-usage-graph', 'relayoutData'),
+    Input('date-range-picker', 'start_date'),
+    Input('date-range-picker', 'end_date'),
+    Input('start-hour', 'value'),
+    Input('start-minute', 'value'),
+    Input('end-hour', 'value'),
+    Input('end-minute', 'value'),
+    Input('host-selector', 'value'),
+    prevent_initial_call=True
+)
+def update_zoom_range(ram_relayout, storage_relayout, cpu_relayout, swap_relayout, *selection):
+    relayouts = {
+        'ram-usage-graph': ram_relayout,
+        'storage-usage-graph': storage_relayout,
+        'cpu-usage-graph': cpu_relayout,
+        'swap-usage-graph': swap_relayout
+    }
+    if ctx.triggered_id in relayouts:
+        return relayout_range(relayouts[ctx.triggered_id])
+    # A new date, time or host selection starts unzoomed
+    return None
 
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,90 @@
+import numpy as np
+
+# Downsampling of time series before they are handed to Plotly: a figure never needs
+# more points than the graph has pixels across.
+
+
+def lttb_indices(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keep the first and last points and, in each of
+    # threshold - 2 buckets, the point forming the largest triangle with the point kept
+    # in the previous bucket and the mean of the next bucket
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[stop:next_stop].mean()
+        next_y = y[stop:next_stop].mean()
+
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas)) if len(areas) else start
+        selected[bucket + 1] = previous
+    return selected
+
+
+def minmax_indices(y, buckets):
+    # Cheaper alternative to LTTB: the lowest and highest point of every bucket
+    n = len(y)
+    if 2 * buckets >= n:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    selected = []
+    for start, stop in zip(edges[:-1], edges[1:]):
+        if stop > start:
+            selected.append(start + int(np.argmin(y[start:stop])))
+            selected.append(start + int(np.argmax(y[start:stop])))
+    return np.unique(selected)
+
+
+def x_values(df, x_column):
+    return df[x_column].to_numpy(dtype='datetime64[ns]').astype(np.int64) if x_column in df else np.arange(len(df))
+
+
+def series_indices(x, y, threshold, method):
+    # Row positions kept for one column, gaps are drawn as gaps and take no part
+    valid = np.flatnonzero(~np.isnan(y))
+    if method == 'minmax':
+        indices = minmax_indices(y[valid], threshold // 2)
+    else:
+        indices = lttb_indices(x[valid], y[valid], threshold)
+    return valid[indices]
+
+
+def downsample_frame(df, y_columns, threshold, x_column='timestamp', method='lttb'):
+    # Rows of df kept for at least one of y_columns, for traces that must share their
+    # x values (stacked bars). The columns split the point budget, so the union never
+    # holds more than about threshold rows.
+    if len(df) <= threshold or not y_columns:
+        return df
+    x = x_values(df, x_column)
+    share = max(threshold // len(y_columns), 3)
+    keep = set()
+    for column in y_columns:
+        keep.update(series_indices(x, df[column].to_numpy(dtype=float), share, method).tolist())
+    return df.iloc[sorted(keep)]
+
+
+def downsample_series(df, y_columns, threshold, x_column='timestamp', method='lttb'):
+    # {column: (x, y)} with each column downsampled on its own to threshold points,
+    # for traces drawn independently (one line per CPU core)
+    series = {}
+    x = x_values(df, x_column)
+    for column in y_columns:
+        y = df[column].to_numpy(dtype=float)
+        indices = series_indices(x, y, threshold, method) if len(df) > threshold else np.arange(len(df))
+        series[column] = (df[x_column].iloc[indices], y[indices])
+    return series
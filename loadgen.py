@@ -0,0 +1,251 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time as t
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from request_stats import LatencyHistogram, RouteStats
+
+# Load generator for the Flask apps. Open loop sends a target rate whatever the
+# server does, closed loop keeps a fixed number of requests in flight. Latency is
+# measured from the time a request was meant to be sent, not from when a busy
+# client got round to it, so a stalled server shows up in the percentiles instead
+# of silently slowing the generator down (coordinated omission). Per-route
+# histograms go to the metrics collection the dashboard reads, with source 'loadgen'.
+DEFAULT_URL = 'http://127.0.0.1:5000'
+DEFAULT_ROUTES = [('GET', '/items', 1), ('POST', '/items', 1)]
+POST_BODY = {'name': 'example_item', 'value': 'example_value'}
+REPORT_INTERVAL = 10  # in seconds, one metrics document per interval
+REQUEST_TIMEOUT = 10  # in seconds
+
+
+def parse_route(value):
+    # METHOD:/path[:weight], e.g. GET:/items:3
+    parts = value.split(':')
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError(f"route must be METHOD:/path[:weight], got {value}")
+    return parts[0].upper(), parts[1], float(parts[2]) if len(parts) == 3 else 1.0
+
+
+class LoadGenerator:
+    def __init__(self, base_url, routes, metrics_collection=None, report_interval=REPORT_INTERVAL, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.routes = routes
+        self.weights = [weight for _, _, weight in routes]
+        self.metrics_collection = metrics_collection
+        self.report_interval = report_interval
+        self.pool_size = pool_size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.interval_stats = {}  # (path, method) -> RouteStats since the last report
+        self.total_stats = {}  # (path, method) -> RouteStats of the whole run
+        self.errors = 0
+        self.should_stop = False
+
+    def session(self):
+        # One keep-alive session per thread, requests.Session is not thread-safe
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self.local.session = session
+        return session
+
+    def send(self, route, intended_time):
+        method, path, _ = route
+        try:
+            response = self.session().request(
+                method,
+                self.base_url + path,
+                json=POST_BODY if method in ('POST', 'PUT') else None,
+                timeout=REQUEST_TIMEOUT
+            )
+            failed = response.status_code >= 400
+        except requests.RequestException:
+            failed = True
+        latency = t.perf_counter() - intended_time
+        with self.lock:
+            for stats in (self.interval_stats, self.total_stats):
+                stats.setdefault((path, method), RouteStats()).record(latency)
+            if failed:
+                self.errors += 1
+
+    def run_open_loop(self, rps, duration=None, threads=32):
+        # Request i is due at start + i / rps; a request that waits for a free
+        # thread is late, and that lateness is part of its latency
+        rng = random.Random()
+        start = t.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            i = 0
+            while not self.should_stop:
+                intended_time = start + i / rps
+                if duration is not None and intended_time - start >= duration:
+                    break
+                delay = intended_time - t.perf_counter()
+                if delay > 0:
+                    t.sleep(delay)
+                executor.submit(self.send, rng.choices(self.routes, self.weights)[0], intended_time)
+                i += 1
+
+    def run_closed_loop(self, concurrency, duration=None):
+        # Each worker sends its next request as soon as the previous one is answered
+        end = t.perf_counter() + duration if duration is not None else None
+
+        def worker():
+            rng = random.Random()
+            while not self.should_stop and (end is None or t.perf_counter() < end):
+                self.send(rng.choices(self.routes, self.weights)[0], t.perf_counter())
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def run_reporter(self):
+        while not self.should_stop:
+            t.sleep(self.report_interval)
+            self.report()
+
+    def report(self):
+        # Same document layout as record.log_metrics, so the dashboard merges them
+        with self.lock:
+            routes, self.interval_stats = self.interval_stats, {}
+        if not routes or self.metrics_collection is None:
+            return
+        total_requests = sum(stats.count for stats in routes.values())
+        total_duration = sum(stats.total_duration for stats in routes.values())
+        metrics = {
+            'timestamp': t.strftime('%Y-%m-%d %H:%M:%S', t.localtime()),
+            'source': 'loadgen',
+            'worker': os.getpid(),
+            'total_requests': total_requests,
+            'total_duration': total_duration,
+            'average_duration': total_duration / total_requests,
+            'routes': [
+                {
+                    'path': path,
+                    'method': method,
+                    'request_count': stats.count,
+                    'total_duration': stats.total_duration,
+                    'average_duration': stats.total_duration / stats.count,
+                    'p50': stats.histogram.percentile(50),
+                    'p95': stats.histogram.percentile(95),
+                    'p99': stats.histogram.percentile(99),
+                    'histogram': stats.histogram.to_document()
+                }
+                for (path, method), stats in routes.items()
+            ]
+        }
+        try:
+            self.metrics_collection.insert_one(metrics)
+        except Exception as e:
+            print(f'There was an issue logging load metrics: {e}', file=sys.stderr)
+
+    def run(self, rps=None, concurrency=None, duration=None, threads=32):
+        reporter = threading.Thread(target=self.run_reporter, daemon=True)
+        reporter.start()
+        try:
+            if rps:
+                self.run_open_loop(rps, duration, threads)
+            else:
+                self.run_closed_loop(concurrency, duration)
+        finally:
+            self.should_stop = True
+            self.report()
+        return self.summary()
+
+    def summary(self):
+        with self.lock:
+            return {
+                'errors': self.errors,
+                'routes': [
+                    {'method': method, 'path': path, 'count': stats.count, 'histogram': stats.histogram.to_document()}
+                    for (path, method), stats in self.total_stats.items()
+                ]
+            }
+
+
+def metrics_collection_for(mongo_uri):
+    from pymongo import MongoClient
+
+    return MongoClient(mongo_uri)['test_ressource']['metrics']
+
+
+def run_process(options):
+    # Entry point of each worker process, with its share of the load
+    collection = metrics_collection_for(options['mongo_uri']) if options['mongo_uri'] else None
+    generator = LoadGenerator(options['url'], options['routes'], collection, pool_size=options['threads'])
+    return generator.run(options['rps'], options['concurrency'], options['duration'], options['threads'])
+
+
+def merge_summaries(summaries, seconds):
+    routes = {}
+    for summary in summaries:
+        for route in summary['routes']:
+            histogram = routes.setdefault((route['method'], route['path']), LatencyHistogram())
+            histogram.merge(LatencyHistogram.from_document(route['histogram']))
+    total = sum(histogram.total() for histogram in routes.values())
+    return {
+        'seconds': seconds,
+        'requests': total,
+        'errors': sum(summary['errors'] for summary in summaries),
+        'requests_per_second': total / seconds if seconds else None,
+        'routes': [
+            {
+                'method': method,
+                'path': path,
+                'count': histogram.total(),
+                'p50_ms': histogram.percentile(50) * 1000,
+                'p95_ms': histogram.percentile(95) * 1000,
+                'p99_ms': histogram.percentile(99) * 1000,
+                'max_ms': histogram.percentile(100) * 1000
+            }
+            for (method, path), histogram in sorted(routes.items())
+        ]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate HTTP load and record latencies")
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--route', action='append', type=parse_route,
+                        help="METHOD:/path[:weight], repeat for a weighted mix (default: GET and POST /items)")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--rps', type=float, help="open loop: total requests per second")
+    mode.add_argument('--concurrency', type=int, help="closed loop: requests in flight")
+    parser.add_argument('--duration', type=float, default=60, help="in seconds")
+    parser.add_argument('--threads', type=int, default=32, help="sender threads per process in open loop")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/', help="metrics store, empty to skip")
+    args = parser.parse_args()
+
+    # Every process takes an equal share of the rate or of the concurrency
+    shares = [
+        {
+            'url': args.url,
+            'routes': args.route or DEFAULT_ROUTES,
+            'rps': args.rps / args.processes if args.rps else None,
+            'concurrency': args.concurrency // args.processes + (i < args.concurrency % args.processes) if args.concurrency else None,
+            'duration': args.duration,
+            'threads': args.threads,
+            'mongo_uri': args.mongo_uri
+        }
+        for i in range(args.processes)
+    ]
+    start_time = t.perf_counter()
+    if args.processes == 1:
+        summaries = [run_process(shares[0])]
+    else:
+        with multiprocessing.Pool(args.processes) as pool:
+            summaries = pool.map(run_process, shares)
+    print(json.dumps(merge_summaries(summaries, t.perf_counter() - start_time), indent=2))
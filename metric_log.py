@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import struct
+from datetime import datetime
+
+from cpu_columns import to_columnar
+
+# Append-only binary log of metric samples.
+#
+# Layout: a header with the column names, then one fixed-width record per sample
+# holding a little-endian float64 per column. The first column is the timestamp in
+# seconds since the epoch, records are appended in time order so a reader finds any
+# time slice with a binary search on that column without parsing the file.
+MAGIC = b'MLOG'
+VERSION = 1
+HEADER_FORMAT = '<4sHHI'  # magic, version, column count, header size
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_seconds(timestamp):
+    return (datetime.strptime(timestamp, TIMESTAMP_FORMAT) - EPOCH).total_seconds()
+
+
+def numeric_columns(document):
+    return [field for field, value in document.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+
+def encode_header(columns):
+    names = b''.join(struct.pack('<H', len(name.encode())) + name.encode() for name in columns)
+    size = struct.calcsize(HEADER_FORMAT) + len(names)
+    size += -size % 8  # Keep the records 8-byte aligned for memory mapping
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(columns), size) + names
+    return header.ljust(size, b'\0')
+
+
+def read_header(f):
+    magic, version, column_count, size = struct.unpack(HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{f.name} is not a version {VERSION} metric log")
+    columns = []
+    for _ in range(column_count):
+        (length,) = struct.unpack('<H', f.read(2))
+        columns.append(f.read(length).decode())
+    return columns, size
+
+
+class MetricLogWriter:
+    """Appends samples to a metric log. The columns are set by the first sample
+    written to a new file, missing fields are stored as NaN. A sample with new fields
+    widens the log: the file is rewritten with the added columns, NaN in earlier records."""
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = None
+        self.record = None
+        self.last_timestamp = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                columns, header_size = read_header(f)
+                self.set_columns(columns)
+                # A file may hold only its header, or end with a record cut short by a crash
+                record_count = (os.path.getsize(path) - header_size) // self.record.size
+                if record_count > 0:
+                    f.seek(header_size + (record_count - 1) * self.record.size)
+                    self.last_timestamp = self.record.unpack(f.read(self.record.size))[0]
+
+    def set_columns(self, columns):
+        self.columns = columns
+        self.record = struct.Struct('<' + 'd' * len(columns))
+
+    def add_columns(self, added):
+        # Rewrite the log with the wider header, through a temporary file so a crash
+        # leaves either the old or the new log
+        old_record = self.record
+        self.set_columns(self.columns + added)
+        padding = [float('nan')] * len(added)
+        temporary_path = self.path + '.tmp'
+        with open(self.path, 'rb') as source, open(temporary_path, 'wb') as target:
+            _, header_size = read_header(source)
+            source.seek(header_size)
+            target.write(encode_header(self.columns))
+            while True:
+                chunk = source.read(old_record.size * 4096)
+                chunk = chunk[:len(chunk) - len(chunk) % old_record.size]
+                if not chunk:
+                    break
+                target.write(b''.join(self.record.pack(*values, *padding) for values in old_record.iter_unpack(chunk)))
+        os.replace(temporary_path, self.path)
+
+    def append(self, document):
+        timestamp = to_epoch_seconds(document['timestamp'])
+        if self.last_timestamp is not None and timestamp < self.last_timestamp:
+            print(f"Skipping out of order sample {document['timestamp']}")
+            return
+
+        if self.columns is None:
+            self.set_columns(['timestamp'] + numeric_columns(document))
+            with open(self.path, 'wb') as f:
+                f.write(encode_header(self.columns))
+
+        added = [column for column in numeric_columns(document) if column not in self.columns]
+        if added:
+            print(f"Adding fields to the log schema: {', '.join(added)}")
+            self.add_columns(added)
+
+        values = [timestamp] + [float(document.get(column, float('nan'))) for column in self.columns[1:]]
+        with open(self.path, 'ab') as f:
+            f.write(self.record.pack(*values))
+        self.last_timestamp = timestamp
+
+
+def open_log(path):
+    # Memory-map the records as a (samples x columns) float64 array
+    import numpy as np
+
+    with open(path, 'rb') as f:
+        columns, header_size = read_header(f)
+    record_count = (os.path.getsize(path) - header_size) // (8 * len(columns))
+    if record_count == 0:
+        return columns, np.empty((0, len(columns)))
+    records = np.memmap(path, dtype='<f8', mode='r', offset=header_size, shape=(record_count, len(columns)))
+    return columns, records
+
+
+def read_slice(path, start=None, end=None):
+    # Columns and records with start <= timestamp <= end, found by binary search
+    import numpy as np
+
+    columns, records = open_log(path)
+    timestamps = records[:, 0]
+    first = 0 if start is None else np.searchsorted(timestamps, (start - EPOCH).total_seconds(), side='left')
+    last = len(timestamps) if end is None else np.searchsorted(timestamps, (end - EPOCH).total_seconds(), side='right')
+    return columns, records[first:last]
+
+
+def read_frame(path, start=None, end=None):
+    import pandas as pd
+
+    columns, records = read_slice(path, start, end)
+    df = pd.DataFrame(records, columns=columns)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
+    return df
+
+
+def iter_concatenated_json(path):
+    # system_status.json holds pretty-printed objects written back to back
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        text = f.read()
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            return
+        document, position = decoder.raw_decode(text, position)
+        yield document
+
+
+def convert_json(json_path, log_path):
+    documents = [to_columnar(d) for d in iter_concatenated_json(json_path) if 'timestamp' in d]
+    documents.sort(key=lambda d: d['timestamp'])
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    writer = MetricLogWriter(log_path)
+    for document in documents:
+        writer.append(document)
+    return len(documents)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert or read a binary metric log")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help="convert a concatenated JSON status file")
+    convert_parser.add_argument('json_path')
+    convert_parser.add_argument('log_path')
+
+    read_parser = subparsers.add_parser('read', help="print a time slice of a log")
+    read_parser.add_argument('log_path')
+    read_parser.add_argument('--start', type=lambda s: datetime.strptime(s, TIMESTAMP_FORMAT))
+    read_parser.add_argument('--end', type=lambda s: datetime.strptime(s, TIMESTAMP_FORMAT))
+
+    args = parser.parse_args()
+    if args.command == 'convert':
+        count = convert_json(args.json_path, args.log_path)
+        print(f"Converted {count} samples: {os.path.getsize(args.json_path)} bytes -> {os.path.getsize(args.log_path)} bytes")
+    else:
+        print(read_frame(args.log_path, args.start, args.end))
@@ -0,0 +1,123 @@
+import os
+import queue
+import threading
+import time as t
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class BufferedMetricWriter:
+    """Buffers documents and writes them to MongoDB from a background thread.
+
+    Batches are flushed with insert_many once batch_size documents are waiting or
+    flush_interval seconds have passed. While the database is unreachable batches
+    are appended to a local spool file, one compact JSON document per line, and
+    replayed in order before anything newer once the database is back.
+    """
+
+    def __init__(self, collection, spool_path, batch_size=100, flush_interval=5.0, listeners=()):
+        self.collection = collection
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.listeners = list(listeners)
+        self.queue = queue.Queue()
+        self.should_stop = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, document):
+        # Never blocks: the id is assigned here so a replayed document keeps it
+        document.setdefault('_id', ObjectId())
+        self.queue.put(document)
+
+    def run(self):
+        while not self.should_stop or not self.queue.empty():
+            batch = self.next_batch()
+            if batch or self.spool_pending():
+                self.flush(batch)
+
+    def next_batch(self):
+        batch = []
+        deadline = t.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - t.time()
+            if timeout <= 0 or (self.should_stop and self.queue.empty()):
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(timeout, 0.5)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def flush(self, batch):
+        # Spooled documents are older, they have to reach the database first
+        if self.spool_pending() and not self.replay_spool():
+            self.spool(batch)
+            return
+        if not batch:
+            return
+        try:
+            self.insert(batch)
+        except Exception as e:
+            print(f'Database unreachable, spooling {len(batch)} documents: {e}')
+            self.spool(batch)
+            return
+        self.notify(batch)
+
+    def insert(self, documents):
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # A replayed batch may have partly reached the database before it failed
+            errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+
+    def notify(self, documents):
+        for listener in self.listeners:
+            try:
+                listener(documents)
+            except Exception as e:
+                print(f'There was an issue in a metric writer listener: {e}')
+
+    def spool_pending(self):
+        return os.path.exists(self.spool_path) and os.path.getsize(self.spool_path) > 0
+
+    def spool(self, documents):
+        if not documents:
+            return
+        with open(self.spool_path, 'a') as f:
+            for document in documents:
+                f.write(json_util.dumps(document))
+                f.write('\n')
+
+    def replay_spool(self):
+        with open(self.spool_path, 'r') as f:
+            documents = [json_util.loads(line) for line in f if line.strip()]
+
+        for start in range(0, len(documents), self.batch_size):
+            chunk = documents[start:start + self.batch_size]
+            try:
+                self.insert(chunk)
+            except Exception as e:
+                print(f'Database still unreachable, keeping the spool: {e}')
+                # Keep only what has not been written yet, in the original order
+                with open(self.spool_path, 'w') as f:
+                    for document in documents[start:]:
+                        f.write(json_util.dumps(document))
+                        f.write('\n')
+                return False
+            self.notify(chunk)
+
+        os.remove(self.spool_path)
+        print(f"Replayed {len(documents)} spooled documents")
+        return True
+
+    def close(self):
+        # Flush whatever is still buffered before returning
+        self.should_stop = True
+        self.thread.join()
@@ -1,9 +1,18 @@
 from flask import Flask, render_template, request, redirect
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, insert, tuple_
+from sqlalchemy.orm import Session
 from datetime import datetime
 import time
+import queue
+import threading
 import concurrent.futures
 
+TASK_COUNT = 20000
+INSERT_CHUNK_SIZE = 1000  # Rows per executemany and per commit
+WRITE_QUEUE_SIZE = 8  # Chunks waiting for the writer, producers block beyond that
+TASKS_PAGE_SIZE = 100
+
 # Create a Flask app
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test2.db'
@@ -14,40 +23,67 @@ class Todo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(200), nullable=False)
     completed = db.Column(db.Integer, default=0)
-    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def __repr__(self):
         return '<Task %r>' % self.id
 
+# SQLite settings for every new connection: WAL lets readers run while a write is
+# in progress, synchronous=NORMAL only syncs the WAL at checkpoints instead of at
+# every commit, and busy_timeout waits for the writer lock instead of failing
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
+
+# SQLite takes one writer at a time, so a single thread owns the writing session and
+# inserts the chunks the other threads put on its queue
+def run_writer(engine, chunks, results):
+    with Session(engine) as session:
+        while True:
+            rows = chunks.get()
+            if rows is None:
+                break
+            start_time = time.time()  # Record the start time
+            try:
+                session.execute(insert(Todo), rows)  # One executemany for the whole chunk
+                session.commit()
+                results.append(len(rows))
+                duration = time.time() - start_time  # Calculate the duration
+                print(f"Inserted {len(rows)} automatic tasks, Duration: {duration:.4f} seconds")
+            except Exception as e:
+                session.rollback()
+                print(f'There was an issue adding your tasks: {e}')
+
 # Use a context manager to create the tables within the Flask application context
 with app.app_context():
+    event.listen(db.engine, 'connect', set_sqlite_pragmas)
     db.create_all()
+    # create_all leaves tables that already exist alone, add their missing indexes
+    for index in Todo.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
 
-    # Function to perform automatic insertion and calculate duration
-    def auto_insert_task(i):
-        task_content = f"Automatic Task {i+1}"
-        start_time = time.time()  # Record the start time
-        
-        new_task = Todo(content=task_content)
-        try:
-            db.session.add(new_task)
-            db.session.commit()
-            
-            end_time = time.time()  # Record the end time
-            duration = end_time - start_time  # Calculate the duration
-            print(f"Inserted automatic task: {new_task.content}, Duration: {duration:.4f} seconds, ID: {new_task.id}")
-        except Exception as e:
-            db.session.rollback()
-            print(f'There was an issue adding your task: {e}')
+    # Function to build one chunk of automatic tasks and queue it for the writer
+    def auto_insert_task(start, chunks):
+        stop = min(start + INSERT_CHUNK_SIZE, TASK_COUNT)
+        chunks.put([{'content': f"Automatic Task {i+1}"} for i in range(start, stop)])
 
     # Automatically insert tasks when the app starts
     start_time = time.time()
+    chunks = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    results = []
+    writer = threading.Thread(target=run_writer, args=(db.engine, chunks, results))
+    writer.start()
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        k=20000
-        executor.map(auto_insert_task, range(k))
+        k = TASK_COUNT
+        list(executor.map(lambda start: auto_insert_task(start, chunks), range(0, k, INSERT_CHUNK_SIZE)))
+    chunks.put(None)
+    writer.join()
     end_time = time.time()
     total_duration = end_time - start_time
-    print(f"Inserted {k} async tasks in {total_duration:.2f} seconds")
+    print(f"Inserted {sum(results)} of {k} tasks in {total_duration:.2f} seconds")
 
 @app.route('/', methods=['POST', 'GET'])
 def index():
@@ -70,8 +106,15 @@ def index():
             db.session.rollback()
             return f'There was an issue adding your task: {e}'
     else:
-        tasks = Todo.query.order_by(Todo.date_created).all()
-        return render_template('index.html', tasks=tasks)
+        # One page at a time along the date_created index, ?after=<task id> gives the
+        # page following that task
+        query = Todo.query.order_by(Todo.date_created, Todo.id)
+        after = db.session.get(Todo, request.args.get('after', type=int) or 0)
+        if after is not None:
+            query = query.filter(tuple_(Todo.date_created, Todo.id) > (after.date_created, after.id))
+        tasks = query.limit(TASKS_PAGE_SIZE).all()
+        next_after = tasks[-1].id if len(tasks) == TASKS_PAGE_SIZE else None
+        return render_template('index.html', tasks=tasks, next_after=next_after)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,218 @@
+import collections
+import os
+import pickle
+import sqlite3
+import threading
+import time as t
+
+# Cache of query results shared by every dashboard session. Entries are keyed by
+# the normalized query (range, tier, host), expire after a TTL, are dropped early
+# when new samples land inside their range, and the least recently used ones are
+# evicted past max_bytes. Concurrent identical queries wait for the first one.
+
+
+class MemoryCacheBackend:
+    """Entries of the current process, in least recently used order."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # key -> (value, size, expires, tag, end)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < t.time():
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl, tag=None, end=None):
+        size = estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, size, t.time() + ttl, tag, end)
+            self.size += size
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key)[1]
+
+    def invalidate(self, tag, since):
+        # Entries of tag whose range reaches past since, they miss the new samples
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[3] == tag and entry[4] is not None and entry[4] >= since]:
+                self.remove(key)
+
+    def acquire_lease(self, key, seconds):
+        # A single process coalesces through QueryCache's own locks
+        return True
+
+    def release_lease(self, key):
+        pass
+
+
+class SQLiteCacheBackend:
+    """Entries in a SQLite file, shared by every worker process on the machine and
+    kept across restarts. Values are pickled, a lease row marks a query being run
+    so other processes wait for its result instead of running it too."""
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        connection = self.connect()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, "
+            "expires REAL, used REAL, tag TEXT, end_at TEXT)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        connection.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL)")
+        connection.commit()
+
+    def connect(self):
+        # sqlite3 connections are not shared across threads
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self.connect()
+        now = t.time()
+        row = connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            connection.execute("DELETE FROM entries WHERE key = ? AND expires < ?", (key, now))
+            connection.commit()
+            return None
+        connection.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+        connection.commit()
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl, tag=None, end=None):
+        connection = self.connect()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = t.time()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now + ttl, now, tag, end)
+            )
+            connection.execute("DELETE FROM entries WHERE expires < ?", (now,))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            for old_key, size in connection.execute("SELECT key, size FROM entries WHERE key != ? ORDER BY used", (key,)).fetchall():
+                if total <= self.max_bytes:
+                    break
+                connection.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                total -= size
+
+    def invalidate(self, tag, since):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM entries WHERE tag IS ? AND end_at >= ?", (tag, since))
+
+    def acquire_lease(self, key, seconds):
+        now = t.time()
+        with self.connect() as connection:
+            connection.execute("DELETE FROM leases WHERE key = ? AND expires < ?", (key, now))
+            cursor = connection.execute("INSERT OR IGNORE INTO leases VALUES (?, ?)", (key, now + seconds))
+        return cursor.rowcount == 1
+
+    def release_lease(self, key):
+        with self.connect() as connection:
+            connection.execute("DELETE FROM leases WHERE key = ?", (key,))
+
+
+def estimate_size(value):
+    # DataFrames report their own footprint, anything else is measured pickled
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class PendingQuery:
+    # A query running in this process, its result is handed to the threads waiting on it
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class QueryCache:
+    def __init__(self, backend, ttl=60, lease_seconds=30, poll_interval=0.05):
+        self.backend = backend
+        self.ttl = ttl
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.pending = {}  # key -> PendingQuery, queries running in this process
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute, ttl=None, tag=None, end=None):
+        # key is a string, tag and end let invalidate() find the entry again
+        value = self.backend.get(key)
+        if value is not None:
+            return value
+
+        with self.lock:
+            pending = self.pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.pending[key] = PendingQuery()
+        if not owner:
+            pending.event.wait()
+            # Taken from the owner, the backend may not keep an entry (too large, or evicted)
+            if pending.value is not None:
+                return pending.value
+            # The query failed, run it here
+            return compute()
+
+        try:
+            pending.value = self.compute_once(key, compute, ttl, tag, end)
+            return pending.value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.event.set()
+
+    def compute_once(self, key, compute, ttl, tag, end):
+        # Across processes: wait while another one holds the lease for this query
+        deadline = t.time() + self.lease_seconds
+        while not self.backend.acquire_lease(key, self.lease_seconds):
+            t.sleep(self.poll_interval)
+            value = self.backend.get(key)
+            if value is not None:
+                return value
+            if t.time() > deadline:
+                return compute()
+        try:
+            # The previous holder may have just stored it
+            value = self.backend.get(key)
+            if value is not None:
+                return value
+            value = compute()
+            self.backend.set(key, value, self.ttl if ttl is None else ttl, tag, end)
+            return value
+        finally:
+            self.backend.release_lease(key)
+
+    def invalidate(self, tag, since):
+        self.backend.invalidate(tag, since)
+
+
+def make_query_cache(backend=None, path=None, ttl=60):
+    # 'memory' for one process, 'sqlite' to share the cache between worker processes
+    backend = backend or os.environ.get('QUERY_CACHE_BACKEND', 'memory')
+    if backend == 'sqlite':
+        return QueryCache(SQLiteCacheBackend(path or os.environ.get('QUERY_CACHE_PATH', 'query_cache.sqlite')), ttl=ttl)
+    if backend == 'memory':
+        return QueryCache(MemoryCacheBackend(), ttl=ttl)
+    raise ValueError(f"Unknown query cache backend {backend}")
@@ -1,56 +1,161 @@
-from flask import Flask, render_template, request, redirect, jsonify, g
+from flask import Flask, render_template, request, redirect, jsonify, g, Response, stream_with_context
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import atexit
+import gzip
+import os
 import time as t
 import schedule
 import threading
-import requests
-from bson import ObjectId
+from bson import ObjectId, json_util
 
 from flask_cors import CORS
 
+from anomaly import AnomalyDetector
+from bulk_ingest import BulkWriter, handle_bulk_request
+from loadgen import DEFAULT_ROUTES, LoadGenerator
+from metric_writer import BufferedMetricWriter, DUPLICATE_KEY_ERROR
+from request_stats import RequestStats
+from rollup import RollupMaintainer
+from serializers import BsonJSONProvider, to_json
+
 app = Flask(__name__)
+app.json = BsonJSONProvider(app)  # jsonify encodes ObjectId and other BSON types in one pass
 CORS(app)
 
-# Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
-db = client['test_ressource']
-collection = db['test2']
-request_log_collection = db['request_log']
-metrics_collection = db['metrics']
-
-# Helper function to convert MongoDB documents to JSON serializable format
-def convert_to_json_serializable(doc):
-    if isinstance(doc, list):
-        return [convert_to_json_serializable(d) for d in doc]
-    elif isinstance(doc, dict):
-        return {k: convert_to_json_serializable(v) for k, v in doc.items()}
-    elif isinstance(doc, ObjectId):
-        return str(doc)
-    return doc
+# MongoDB connection, opened by connect_database in the process that serves the
+# requests. A MongoClient is not fork-safe, so forked workers must not inherit one.
+MONGO_URI = 'mongodb://localhost:27017/'
+client = None
+db = None
+collection = None
+request_log_collection = None
+metrics_collection = None
+host_metrics_collection = None  # Samples pushed by agent.py, one document per host and interval
+
+# Per-host rollup tiers and alerts of the pushed samples. Under several workers each
+# one sees part of a host's samples. Rollups are merged into the stored buckets, so
+# they come out the same whichever worker got a sample, and so do threshold alerts.
+# The z-score and EWMA rules only learn from that worker's share.
+host_rollups = None
+host_anomalies = None
+
+# Function to connect to MongoDB and create the indexes, once per process
+def connect_database():
+    global client, db, collection, request_log_collection, metrics_collection, host_metrics_collection, host_rollups, host_anomalies
+    client = MongoClient(MONGO_URI)
+    db = client['test_ressource']
+    collection = db['test2']
+    request_log_collection = db['request_log']
+    metrics_collection = db['metrics']
+    host_metrics_collection = db['host_metrics']
+    host_rollups = RollupMaintainer(host_metrics_collection, group_field='host')
+    host_anomalies = AnomalyDetector(db['alerts'], 'host_metrics')
+    try:
+        host_metrics_collection.create_index([('host', 1), ('timestamp', 1)])
+        host_rollups.ensure_indexes()
+        host_anomalies.ensure_indexes()
+    except Exception as e:
+        print(f'There was an issue creating the host metrics indexes: {e}')
+    try:
+        # One request count record per interval, see count_requests_last_5_minutes
+        collection.create_index('timestamp', unique=True, partialFilterExpression={'request_count': {'$exists': True}})
+    except Exception as e:
+        print(f'There was an issue creating the request count index: {e}')
+
+# Request logs are buffered in memory and written by a background thread
+REQUEST_LOG_SPOOL_PATH = 'request_log.spool'
+REQUEST_LOG_BATCH_SIZE = 500
+REQUEST_LOG_FLUSH_INTERVAL = 2  # in seconds
+
+# Pagination of GET /items
+ITEMS_PAGE_SIZE = 100
+ITEMS_MAX_PAGE_SIZE = 1000
+
+# Background work. Every worker process runs its own scheduler, since the request
+# counters it reports live in that process. Their reports still add up to one record
+# per interval: workers add their request count to a shared document, and metrics
+# documents are merged per minute by the dashboard. Jobs that must run once per
+# deployment only run in the worker holding the leader lock.
+LEADER_LOCK_PATH = os.environ.get('RECORD_LEADER_LOCK', 'record.leader.lock')
+AUTO_REQUESTS = os.environ.get('RECORD_AUTO_REQUESTS') == '1'  # Opt-in self-traffic, see loadgen.py for real load
+AUTO_REQUESTS_RPS = 1
+WORKER_ID = None  # pid of the process once its background threads run, tags its metrics
+
+try:
+    import fcntl
+
+    def lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+except ImportError:
+    import msvcrt
+
+    def lock_file(f):
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+class LeaderLock:
+    """Non-blocking lock on a local file, held by one process until it exits. The
+    operating system releases it when the holder dies, so another worker takes over
+    the next time it asks."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.pid = None
+
+    def is_leader(self):
+        # A lock inherited through fork belongs to the parent, not to this worker
+        if self.file is not None and self.pid == os.getpid():
+            return True
+        f = open(self.path, 'a+')
+        try:
+            lock_file(f)
+        except OSError:
+            f.close()
+            return False
+        self.file = f
+        self.pid = os.getpid()
+        return True
+
+leader_lock = LeaderLock(LEADER_LOCK_PATH)
+
+# Created with the background threads, in the process that serves the requests
+request_log_writer = None
+bulk_writer = None  # Writes the chunks of POST /items/bulk
+self_traffic = None  # LoadGenerator sending the opt-in self-traffic
+
+# Rolling per-route counters the scheduled jobs read instead of querying request_log
+request_stats = RequestStats(bucket_seconds=10, window_seconds=10 * 60)
 
 # Log each request
 @app.before_request
 def log_request():
+    if WORKER_ID != os.getpid():
+        # Served by a WSGI server without a post_fork hook, e.g. gunicorn record:app
+        start_background_threads()
     g.start_time = t.time()
-    request_log = {
-        'path': request.path,
-        'method': request.method,
-        'timestamp': g.start_time
-    }
-    request_log_collection.insert_one(request_log)
 
 @app.after_request
 def log_response(response):
+    # One completed record per request, queued without touching the database
     if hasattr(g, 'start_time'):
         duration = t.time() - g.start_time
-        request_log_collection.update_one(
-            {'timestamp': g.start_time},
-            {'$set': {'duration': duration}}
-        )
+        request_stats.record(request.path, request.method, duration)
+        if request_log_writer is None:
+            return response
+        request_log_writer.write({
+            'path': request.path,
+            'method': request.method,
+            'timestamp': g.start_time,
+            'duration': duration,
+            'status': response.status_code
+        })
     return response
 
-# Function to perform periodic insertion
+# Function to perform periodic insertion, once per deployment
 def periodic_insert():
+    if not leader_lock.is_leader():
+        return
     try:
         record = {
             'timestamp': t.strftime('%Y-%m-%d %H:%M:%S', t.localtime()),
@@ -61,18 +166,26 @@ def periodic_insert():
     except Exception as e:
         print(f'There was an issue adding your task: {e}')
 
-# Function to count requests in the last 5 minutes and save the result
+# Function to count requests in the last 5 minutes and save the result. Every worker
+# adds its count to the record of the interval, workers tells how many reported.
 def count_requests_last_5_minutes():
     try:
         current_time = t.time()
-        five_minutes_ago = current_time - 5 * 60
-        count = request_log_collection.count_documents({'timestamp': {'$gte': five_minutes_ago}})
-        result = {
-            'timestamp': t.strftime('%Y-%m-%d %H:%M:%S', t.localtime(current_time)),
-            'request_count': count
+        routes = request_stats.snapshot(5 * 60, now=current_time)
+        count = sum(stats.count for stats in routes.values())
+        # Workers run the job a moment apart, they all fall in the same interval
+        interval_start = current_time - current_time % (5 * 60)
+        record = {
+            'timestamp': t.strftime('%Y-%m-%d %H:%M:%S', t.localtime(interval_start)),
+            'request_count': {'$exists': True}
         }
-        collection.insert_one(result)
-        print(f"Inserted count record: {result}")
+        update = {'$inc': {'request_count': count, 'workers': 1}}
+        try:
+            collection.update_one(record, update, upsert=True)
+        except DuplicateKeyError:
+            # Another worker created the record at the same moment
+            collection.update_one(record, update)
+        print(f"Added {count} requests to the count record of {record['timestamp']}")
     except Exception as e:
         print(f'There was an issue counting requests: {e}')
 
@@ -80,16 +193,31 @@ def count_requests_last_5_minutes():
 def log_metrics():
     try:
         current_time = t.time()
-        ten_minutes_ago = current_time - 10 * 60
-        requests = list(request_log_collection.find({'timestamp': {'$gte': ten_minutes_ago}}))
-        total_requests = len(requests)
-        total_duration = sum(request['duration'] for request in requests if 'duration' in request)
-        
+        routes = request_stats.snapshot(10 * 60, now=current_time)
+        total_requests = sum(stats.count for stats in routes.values())
+        total_duration = sum(stats.total_duration for stats in routes.values())
+
         metrics = {
             'timestamp': t.strftime('%Y-%m-%d %H:%M:%S', t.localtime(current_time)),
+            'worker': WORKER_ID,  # One document per worker and interval, histograms merge across them
             'total_requests': total_requests,
             'total_duration': total_duration,
-            'average_duration': total_duration / total_requests if total_requests > 0 else 0
+            'average_duration': total_duration / total_requests if total_requests > 0 else 0,
+            'routes': [
+                {
+                    'path': path,
+                    'method': method,
+                    'request_count': stats.count,
+                    'total_duration': stats.total_duration,
+                    'average_duration': stats.total_duration / stats.count,
+                    'p50': stats.histogram.percentile(50),
+                    'p95': stats.histogram.percentile(95),
+                    'p99': stats.histogram.percentile(99),
+                    # Histograms of consecutive intervals can be merged for any range
+                    'histogram': stats.histogram.to_document()
+                }
+                for (path, method), stats in routes.items()
+            ]
         }
         metrics_collection.insert_one(metrics)
         print(f"Inserted metrics record: {metrics}")
@@ -102,73 +230,204 @@ def run_schedule():
         schedule.run_pending()
         t.sleep(1)
 
+# Run job at every multiple of minutes past the hour, so every worker reports the
+# same intervals
+def every_minutes_aligned(minutes, job):
+    for minute in range(0, 60, minutes):
+        schedule.every().hour.at(f":{minute:02d}").do(job)
+
 # Schedule the periodic insert task and the request count task
 schedule.every(1).minutes.do(periodic_insert)
-schedule.every(5).minutes.do(count_requests_last_5_minutes)
-schedule.every(10).minutes.do(log_metrics)
+every_minutes_aligned(5, count_requests_last_5_minutes)
+every_minutes_aligned(10, log_metrics)
 
-# Function to send GET and POST requests automatically
-def send_get_request():
-    try:
-        response = requests.get('http://127.0.0.1:5000/items')
-        if response.status_code == 200:
-            print('GET request successful.')
-        else:
-            print(f'GET request failed with status code {response.status_code}.')
-    except Exception as e:
-        print(f'An error occurred: {e}')
+# Define a flag to indicate that the script should stop
+should_stop = False
+background_threads = []
+background_lock = threading.Lock()
 
-def send_post_request():
-    try:
-        data = {'name': 'example_item', 'value': 'example_value'}
-        response = requests.post('http://127.0.0.1:5000/items', json=data)
-        if response.status_code == 200:
-            print('POST request successful.')
-        else:
-            print(f'POST request failed with status code {response.status_code}.')
-    except Exception as e:
-        print(f'An error occurred: {e}')
+# Connect and start the threads of this process. Nothing starts at import: a WSGI
+# server that imports the app before forking would otherwise leave the client and
+# the threads in the parent.
+def start_background_threads():
+    global WORKER_ID, request_log_writer, bulk_writer, self_traffic
+    with background_lock:
+        if WORKER_ID == os.getpid():
+            return
+        WORKER_ID = os.getpid()
+        del background_threads[:]
+        connect_database()
+        request_log_writer = BufferedMetricWriter(
+            request_log_collection,
+            REQUEST_LOG_SPOOL_PATH,
+            batch_size=REQUEST_LOG_BATCH_SIZE,
+            flush_interval=REQUEST_LOG_FLUSH_INTERVAL
+        )
+        bulk_writer = BulkWriter(collection)
 
-def auto_run_requests():
-    while not should_stop:
-        send_get_request()
-        t.sleep(1)  # Wait for 1 second before sending the next request
-        send_post_request()
-        t.sleep(1)  # Wait for 1 second before sending the next request
+        # Start the scheduling thread
+        background_threads.append(threading.Thread(target=run_schedule, daemon=True))
 
-# Define a flag to indicate that the script should stop
-should_stop = False
+        # Start the auto-request thread, in one worker only
+        if AUTO_REQUESTS and leader_lock.is_leader():
+            self_traffic = LoadGenerator('http://127.0.0.1:5000', DEFAULT_ROUTES, metrics_collection)
+            background_threads.append(threading.Thread(target=self_traffic.run, kwargs={'rps': AUTO_REQUESTS_RPS}, daemon=True))
+
+        for thread in background_threads:
+            thread.start()
+        atexit.register(stop_background_threads)
 
-# Start the scheduling thread
-schedule_thread = threading.Thread(target=run_schedule)
-schedule_thread.start()
+def stop_background_threads():
+    global should_stop
+    should_stop = True
+    if self_traffic is not None:
+        self_traffic.should_stop = True
+    for thread in background_threads:
+        thread.join()
 
-# Start the auto-request thread
-auto_request_thread = threading.Thread(target=auto_run_requests)
-auto_request_thread.start()
+    # Write the request logs still buffered
+    if request_log_writer is not None:
+        request_log_writer.close()
 
-# Example route to get all items
+# Example route to get items, one page at a time.
+# Pages are keyed on _id: pass the next_after of a page as ?after= to get the next one.
+# With ?format=ndjson everything after ?after= (up to ?limit= if given) is streamed instead.
 @app.route('/items', methods=['GET'])
 def get_items():
-    items = list(collection.find())
-    items = convert_to_json_serializable(items)  # Convert items to JSON serializable format
-    return jsonify(items)
+    limit = request.args.get('limit')
+    try:
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    query = {}
+    after = request.args.get('after')
+    if after:
+        if not ObjectId.is_valid(after):
+            return jsonify({'error': 'after must be an item id'}), 400
+        query['_id'] = {'$gt': ObjectId(after)}
+    cursor = collection.find(query).sort('_id', 1).batch_size(ITEMS_PAGE_SIZE)
+
+    if request.args.get('format') == 'ndjson':
+        if limit is not None:
+            cursor = cursor.limit(limit)
+
+        def generate():
+            # One chunk per cursor batch, so memory stays bounded by the batch size
+            lines = []
+            for item in cursor:
+                lines.append(to_json(item))
+                if len(lines) == ITEMS_PAGE_SIZE:
+                    yield b'\n'.join(lines) + b'\n'
+                    lines = []
+            if lines:
+                yield b'\n'.join(lines) + b'\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    limit = min(limit or ITEMS_PAGE_SIZE, ITEMS_MAX_PAGE_SIZE)
+    items = list(cursor.limit(limit))
+    next_after = str(items[-1]['_id']) if len(items) == limit else None
+    return jsonify({'items': items, 'next_after': next_after})
 
 # Example route to create a new item
 @app.route('/items', methods=['POST'])
 def create_item():
     data = request.get_json()
+    if '_id' in data:
+        # Pages of GET /items are keyed on ObjectId _ids
+        return jsonify({'error': 'an item _id is assigned by the server'}), 400
     item_id = collection.insert_one(data).inserted_id
     return jsonify({'id': str(item_id)})
 
-if __name__ == '__main__':
+# Bulk route: a JSON array or NDJSON of items, written in chunks with unordered insert_many
+@app.route('/items/bulk', methods=['POST'])
+def create_items_bulk():
+    return handle_bulk_request(bulk_writer, request)
+
+# Ingest route for agent.py: a batch of samples as NDJSON, optionally gzip-compressed
+@app.route('/ingest/metrics', methods=['POST'])
+def ingest_metrics():
+    body = request.get_data()
+    if request.headers.get('Content-Encoding') == 'gzip':
+        try:
+            body = gzip.decompress(body)
+        except OSError:
+            return jsonify({'error': 'body is not valid gzip'}), 400
+
     try:
+        documents = [json_util.loads(line) for line in body.splitlines() if line.strip()]
+    except ValueError:
+        return jsonify({'error': 'body must be one JSON document per line'}), 400
+    for document in documents:
+        if not isinstance(document, dict) or not isinstance(document.get('host'), str) or not isinstance(document.get('timestamp'), str):
+            return jsonify({'error': 'every sample needs a host and a timestamp'}), 400
+    if not documents:
+        return jsonify({'inserted': 0})
+
+    inserted = len(documents)
+    rejected = []
+    try:
+        host_metrics_collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if e.details.get('writeConcernErrors'):
+            raise
+        # Agents replay their spool after an outage, samples already stored are skipped.
+        # Other write errors would fail again on a retry, they are reported with a 422.
+        errors = e.details.get('writeErrors', [])
+        rejected = [
+            {'index': error['index'], 'code': error.get('code'), 'message': error.get('errmsg')}
+            for error in errors
+            if error.get('code') != DUPLICATE_KEY_ERROR
+        ]
+        # Only the samples written now go on, a replayed one is already in the rollups
+        failed = {error['index'] for error in errors}
+        documents = [document for i, document in enumerate(documents) if i not in failed]
+        inserted = e.details.get('nInserted', len(documents))
+    try:
+        host_rollups.add_samples(sorted(documents, key=lambda document: document['timestamp']))
+    except Exception as e:
+        print(f'There was an issue rolling up the samples: {e}')
+    try:
+        host_anomalies.add_samples(documents)
+    except Exception as e:
+        print(f'There was an issue checking the samples for alerts: {e}')
+    if rejected:
+        return jsonify({'error': 'some samples were rejected', 'inserted': inserted, 'errors': rejected}), 422
+    return jsonify({'inserted': inserted})
+
+# Production mode: python record.py --workers 4 serves the app from gunicorn worker
+# processes (equivalent to gunicorn -w 4 -b 127.0.0.1:5000 record:app)
+def run_production(workers, bind):
+    from gunicorn.app.base import BaseApplication
+
+    class RecordApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('workers', workers)
+            self.cfg.set('bind', bind)
+            self.cfg.set('preload_app', False)
+            # Every worker starts its threads as soon as it is forked, not on its first request
+            self.cfg.set('post_fork', lambda server, worker: start_background_threads())
+
+        def load(self):
+            return app
+
+    RecordApplication().run()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the items API")
+    parser.add_argument('--workers', type=int, default=0, help="gunicorn worker processes, 0 runs the debug server")
+    parser.add_argument('--bind', default='127.0.0.1:5000')
+    args = parser.parse_args()
+
+    if args.workers:
+        run_production(args.workers, args.bind)
+    else:
+        # The reloader runs the app in a child process, only that one serves requests
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_threads()
         app.run(debug=True, host='127.0.0.1', port=5000)
-    finally:
-        # Stop the scheduling thread
-        should_stop = True
-        schedule_thread.join()
-
-        # Stop the auto-request thread
-        should_stop = True
-        auto_request_thread.join()
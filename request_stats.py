@@ -0,0 +1,130 @@
+import math
+import threading
+import time as t
+
+# Latency histogram buckets grow geometrically from MIN_LATENCY, so every bucket
+# has the same relative width (about 10%) from microseconds up to minutes
+MIN_LATENCY = 1e-5  # in seconds
+GROWTH = 1.1
+
+
+class LatencyHistogram:
+    """Sparse log-bucketed histogram of durations in seconds. Two histograms merge
+    by adding their bucket counts, so windows and workers can be combined freely."""
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    @staticmethod
+    def bucket_index(duration):
+        if duration <= MIN_LATENCY:
+            return 0
+        return int(math.log(duration / MIN_LATENCY, GROWTH)) + 1
+
+    def record(self, duration):
+        index = self.bucket_index(duration)
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        return self
+
+    def total(self):
+        return sum(self.counts.values())
+
+    @staticmethod
+    def bucket_value(index):
+        # Geometric middle of the bucket, within GROWTH / 2 of any duration it holds
+        if index == 0:
+            return MIN_LATENCY
+        return MIN_LATENCY * GROWTH ** (index - 0.5)
+
+    def percentile(self, q):
+        # Duration below which q percent of the recorded durations fall, None if empty
+        total = self.total()
+        if total == 0:
+            return None
+        rank = max(int(math.ceil(q / 100.0 * total)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return self.bucket_value(index)
+
+    def to_document(self):
+        # MongoDB keys must be strings, so the sparse buckets are stored as two lists
+        indexes = sorted(self.counts)
+        return {
+            'min_latency': MIN_LATENCY,
+            'growth': GROWTH,
+            'buckets': indexes,
+            'counts': [self.counts[index] for index in indexes]
+        }
+
+    @classmethod
+    def from_document(cls, document):
+        if document['min_latency'] != MIN_LATENCY or document['growth'] != GROWTH:
+            raise ValueError("Histogram was stored with a different bucket layout")
+        return cls(zip(document['buckets'], document['counts']))
+
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.total_duration = 0.0
+        self.histogram = LatencyHistogram()
+
+    def record(self, duration):
+        self.count += 1
+        self.total_duration += duration
+        self.histogram.record(duration)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total_duration += other.total_duration
+        self.histogram.merge(other.histogram)
+        return self
+
+
+class RequestStats:
+    """Per-route request counters over a rolling window.
+
+    Requests land in a ring of fixed-width time buckets, a snapshot of the last N
+    seconds merges at most window_seconds / bucket_seconds buckets no matter how
+    much traffic there was.
+    """
+
+    def __init__(self, bucket_seconds=10, window_seconds=10 * 60):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = int(math.ceil(window_seconds / bucket_seconds))
+        self.buckets = [None] * self.bucket_count  # (bucket number, {(path, method): RouteStats})
+        self.lock = threading.Lock()
+
+    def record(self, path, method, duration, now=None):
+        number = int((now if now is not None else t.time()) // self.bucket_seconds)
+        slot = number % self.bucket_count
+        with self.lock:
+            bucket = self.buckets[slot]
+            if bucket is None or bucket[0] != number:
+                # The slot held a bucket that has aged out of the window
+                bucket = (number, {})
+                self.buckets[slot] = bucket
+            routes = bucket[1]
+            stats = routes.get((path, method))
+            if stats is None:
+                stats = routes[(path, method)] = RouteStats()
+            stats.record(duration)
+
+    def snapshot(self, window_seconds, now=None):
+        # Merged stats per (path, method) for the last window_seconds
+        current = int((now if now is not None else t.time()) // self.bucket_seconds)
+        oldest = current - min(int(math.ceil(window_seconds / self.bucket_seconds)), self.bucket_count) + 1
+        merged = {}
+        with self.lock:
+            for bucket in self.buckets:
+                if bucket is None or not oldest <= bucket[0] <= current:
+                    continue
+                for route, stats in bucket[1].items():
+                    merged.setdefault(route, RouteStats()).merge(stats)
+        return merged
@@ -1,7 +1,8 @@
 import os
+import threading
+from contextlib import contextmanager
 from flask import Flask, render_template, request, redirect
-import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 import time as t  # Renamed the time module to t
@@ -23,45 +24,65 @@ settings, config = get_settings()
 # Port configuration
 port = settings.get('port')
 
-# Function to get MySQL connection
-def get_db_connection():
-    connection = None
-    try:
-        connection = mysql.connector.connect(**config)
-    except Error as e:
-        print(f"Error: {e}")
-    return connection
-
-# Function to perform automatic insertion and calculate duration
-def auto_insert_task(i):
-    task_content = f"Automatic Task {i+1}"
-    start_time = t.time()  # Record the start time
+# Pool configuration, rows are inserted commit_size at a time
+pool_size = min(settings.get('pool_size', 5), pooling.CNX_POOL_MAXSIZE)
+commit_size = settings.get('commit_size', 1000)
+
+# MySQL connection pool shared by the insert tasks
+connection_pool = None
+try:
+    connection_pool = pooling.MySQLConnectionPool(pool_name='ressource_pool', pool_size=pool_size, **config)
+except Error as e:
+    print(f"Error: {e}")
 
-    connection = get_db_connection()
-    if connection:
-        cursor = connection.cursor()
+# The pool raises instead of waiting when it is exhausted, so callers queue here
+pool_slots = threading.BoundedSemaphore(pool_size)
+
+# Function to borrow a pooled MySQL connection, closing it returns it to the pool
+@contextmanager
+def get_db_connection():
+    with pool_slots:
+        connection = None
         try:
-            cursor.execute("INSERT INTO todo (content) VALUES (%s)", (task_content,))
-            connection.commit()
-
-            end_time = t.time()  # Record the end time
-            duration = end_time - start_time  # Calculate the duration
-            print(f"Inserted automatic task: {task_content}, Duration: {duration:.4f} seconds")
-        except Error as e:
-            connection.rollback()
-            print(f'There was an issue adding your task: {e}')
+            connection = connection_pool.get_connection()
+        except Exception as e:
+            print(f"Error: {e}")
+        try:
+            yield connection
         finally:
-            cursor.close()
-            connection.close()
+            if connection:
+                connection.close()
+
+# Function to insert a chunk of tasks in one executemany and one commit
+def auto_insert_task(start, stop):
+    rows = [(f"Automatic Task {i+1}",) for i in range(start, stop)]
+    start_time = t.time()  # Record the start time
+
+    with get_db_connection() as connection:
+        if connection:
+            cursor = connection.cursor()
+            try:
+                cursor.executemany("INSERT INTO todo (content) VALUES (%s)", rows)
+                connection.commit()
+
+                end_time = t.time()  # Record the end time
+                duration = end_time - start_time  # Calculate the duration
+                print(f"Inserted automatic tasks {start+1} to {stop}, Duration: {duration:.4f} seconds")
+            except Error as e:
+                connection.rollback()
+                print(f'There was an issue adding your tasks: {e}')
+            finally:
+                cursor.close()
 
 # Automatically insert tasks when the app starts
 def auto_insert_tasks():
     # Check if the tasks have already been inserted
     if not os.path.exists('tasks_inserted.txt'):
         start_time = t.time()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as executor:
             k = 10000
-            executor.map(auto_insert_task, range(k))
+            starts = range(0, k, commit_size)
+            executor.map(auto_insert_task, starts, [min(start + commit_size, k) for start in starts])
         end_time = t.time()
         total_duration = end_time - start_time
         print(f"Inserted {k} async tasks in {total_duration:.2f} seconds")
@@ -6,13 +6,32 @@ import concurrent.futures
 
 from flask_cors import CORS
 
+from async_ingest import run_insert_tasks_async
+from bulk_ingest import BulkWriter, handle_bulk_request
+from serializers import BsonJSONProvider
+
 app = Flask(__name__)
+app.json = BsonJSONProvider(app)  # Items straight from MongoDB carry ObjectIds
 CORS(app)
 
+# MongoDB connection details
+MONGO_URI = 'mongodb://localhost:27017/'
+DB_NAME = 'test_ressource'
+COLLECTION_NAME = 'test'
+
+# Insert mode for the startup tasks: 'threaded' (one insert_one per executor task)
+# or 'async' (asyncio driver, ASYNC_MAX_IN_FLIGHT inserts in flight, ASYNC_BATCH_SIZE tasks per insert)
+INSERT_MODE = os.environ.get('INSERT_MODE', 'threaded')
+ASYNC_MAX_IN_FLIGHT = 200
+ASYNC_BATCH_SIZE = 1
+
 # Connect to MongoDB
-client = MongoClient('mongodb://localhost:27017/')
-db = client['test_ressource']
-collection = db['test']
+client = MongoClient(MONGO_URI)
+db = client[DB_NAME]
+collection = db[COLLECTION_NAME]
+
+# Chunks of POST /items/bulk are written by background threads
+bulk_writer = BulkWriter(collection)
 
 # Function to perform automatic insertion and calculate duration
 def auto_insert_task(i):
@@ -28,16 +47,25 @@ def auto_insert_task(i):
         print(f'There was an issue adding your task: {e}')
 
 # Automatically insert tasks when the app starts
-def auto_insert_tasks():
+def auto_insert_tasks(mode=INSERT_MODE):
     # Check if the tasks have already been inserted
     if not os.path.exists('tasks_inserted.txt'):
-        start_time = t.time()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            k = 100
-            executor.map(auto_insert_task, range(k))
-        end_time = t.time()
-        total_duration = end_time - start_time
-        print(f"Inserted {k} async tasks in {total_duration:.2f} seconds")
+        k = 100
+        if mode == 'async':
+            total_duration, failures = run_insert_tasks_async(
+                MONGO_URI, DB_NAME, COLLECTION_NAME, k,
+                max_in_flight=ASYNC_MAX_IN_FLIGHT,
+                batch_size=ASYNC_BATCH_SIZE
+            )
+            if failures:
+                print(f"{failures} inserts failed")
+        else:
+            start_time = t.time()
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                executor.map(auto_insert_task, range(k))
+            end_time = t.time()
+            total_duration = end_time - start_time
+        print(f"Inserted {k} {mode} tasks in {total_duration:.2f} seconds")
 
         # Create a file to indicate that the tasks have been inserted
         with open('tasks_inserted.txt', 'w') as f:
@@ -61,5 +89,10 @@ def create_item():
     item_id = collection.insert_one(data).inserted_id
     return jsonify({'id': str(item_id)})
 
+# Bulk route: a JSON array or NDJSON of items, written in chunks with unordered insert_many
+@app.route('/items/bulk', methods=['POST'])
+def create_items_bulk():
+    return handle_bulk_request(bulk_writer, request)
+
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=5000)
@@ -0,0 +1,304 @@
+import math
+import threading
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Rollup tiers and their bucket width in seconds, from finest to coarsest
+ROLLUP_TIERS = {
+    '1m': 60,
+    '5m': 5 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60
+}
+
+# Statistics kept for every numeric field, the mean is stored under the field's own name
+ROLLUP_STATS = ['min', 'max', 'p95']
+
+# Companions the sampler stores next to a window's mean (see sampler.aggregate). They
+# are folded into the bucket's own min and max, not rolled up as fields of their own.
+SAMPLE_EXTREMES = ['min', 'max']
+
+
+def rollup_collection_name(collection_name, tier):
+    return f"{collection_name}_rollup_{tier}"
+
+
+def bucket_start(timestamp, seconds):
+    # Align the bucket on the epoch so every tier lines up with the finer ones
+    epoch = datetime(1970, 1, 1)
+    offset = int((timestamp - epoch).total_seconds())
+    return epoch + timedelta(seconds=offset - offset % seconds)
+
+
+def numeric_fields(status):
+    # Keep numbers and lists of numbers (per-core CPU), skip ids and strings
+    values = {}
+    for field, value in status.items():
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            values[field] = value
+        elif isinstance(value, list) and all(isinstance(v, (int, float)) for v in value):
+            values[field] = value
+    return values
+
+
+def sample_values(status):
+    # field -> (mean, min, max) of every numeric field of a sample, a field without
+    # sampler companions is its own min and max
+    values = numeric_fields(status)
+    companions = {
+        f"{field}_{extreme}"
+        for field in values
+        for extreme in SAMPLE_EXTREMES
+        if f"{field}_{extreme}" in values
+    }
+    return {
+        field: (value, values.get(f"{field}_min", value), values.get(f"{field}_max", value))
+        for field, value in values.items()
+        if field not in companions
+    }
+
+
+def percentile(values, q):
+    # Nearest-rank percentile, values must not be empty
+    ordered = sorted(values)
+    rank = max(int(math.ceil(q / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    # values holds one (mean, min, max) triple per sample
+    means = [value[0] for value in values]
+    return {
+        'mean': sum(means) / len(means),
+        'min': min(value[1] for value in values),
+        'max': max(value[2] for value in values),
+        'p95': percentile(means, 95),
+        'sum': sum(means),
+        'n': len(means)
+    }
+
+
+def summarize_bucket(start, samples):
+    # samples maps each field to the (mean, min, max) triples seen in the bucket,
+    # per-core fields hold one list of triples per core
+    document = {'timestamp': start.strftime(TIMESTAMP_FORMAT), 'count': 0}
+    for field, values in samples.items():
+        if values and isinstance(values[0], list):
+            per_core = [summarize(core_values) for core_values in values]
+            document[field] = [stats['mean'] for stats in per_core]
+            for stat in ROLLUP_STATS:
+                document[f"{field}_{stat}"] = [stats[stat] for stats in per_core]
+        else:
+            stats = summarize(values)
+            document[field] = stats['mean']
+            for stat in ROLLUP_STATS:
+                document[f"{field}_{stat}"] = stats[stat]
+            # Running totals, so samples arriving later merge into the bucket
+            document[f"{field}_sum"] = stats['sum']
+            document[f"{field}_n"] = stats['n']
+            document['count'] = max(document['count'], stats['n'])
+    return document
+
+
+def sample_update(status):
+    # Update pipeline merging one sample into its bucket document: running count,
+    # sum, min and max of every field, then the mean under the field's own name.
+    # Only the stored document is read, so any number of processes can merge into
+    # the same bucket.
+    merged = {'count': {'$add': [{'$ifNull': ['$count', 0]}, 1]}}
+    means = {}
+    for field, (value, low, high) in sample_values(status).items():
+        if isinstance(value, list):
+            # Nested per-core lists only exist in old documents, see backfill
+            continue
+        merged[f"{field}_sum"] = {'$add': [{'$ifNull': [f"${field}_sum", 0]}, value]}
+        merged[f"{field}_n"] = {'$add': [{'$ifNull': [f"${field}_n", 0]}, 1]}
+        merged[f"{field}_min"] = {'$min': [f"${field}_min", low]}
+        merged[f"{field}_max"] = {'$max': [f"${field}_max", high]}
+        means[field] = {'$divide': [f"${field}_sum", f"${field}_n"]}
+    return [{'$set': merged}, {'$set': means}]
+
+
+def add_values(samples, status):
+    for field, (value, low, high) in sample_values(status).items():
+        if isinstance(value, list):
+            per_core = samples.setdefault(field, [])
+            while len(per_core) < len(value):
+                per_core.append([])
+            for core, core_values in enumerate(zip(value, low, high)):
+                per_core[core].append(core_values)
+        else:
+            samples.setdefault(field, []).append((value, low, high))
+
+
+def bucket_filter(document, group_field):
+    if group_field is None:
+        return {'timestamp': document['timestamp']}
+    return {group_field: document[group_field], 'timestamp': document['timestamp']}
+
+
+class RollupMaintainer:
+    """Keeps the rollup tiers of a raw sample collection up to date, one sample at a time.
+
+    Each sample is merged into its buckets with running count, sum, min and max;
+    p95 needs every value, it is computed from the raw samples when a bucket closes.
+    With group_field set (e.g. 'host') every value of that field gets its own buckets.
+    """
+
+    def __init__(self, raw_collection, tiers=ROLLUP_TIERS, group_field=None):
+        self.raw_collection = raw_collection
+        self.tiers = tiers
+        self.group_field = group_field
+        self.collections = rollup_collections(raw_collection, tiers)
+        self.latest_buckets = {}  # (tier, group) -> start of the newest bucket seen
+        self.lock = threading.Lock()  # Samples may arrive from several request threads
+
+    def ensure_indexes(self):
+        for tier_collection in self.collections.values():
+            if self.group_field is None:
+                tier_collection.create_index('timestamp', unique=True)
+            else:
+                tier_collection.create_index([(self.group_field, 1), ('timestamp', 1)], unique=True)
+
+    def bucket(self, start, group):
+        document = {'timestamp': start.strftime(TIMESTAMP_FORMAT)}
+        if self.group_field is not None:
+            document[self.group_field] = group
+        return document
+
+    def close_bucket(self, tier, start, group):
+        # p95 of every field over the raw samples of the bucket
+        end = start + timedelta(seconds=self.tiers[tier])
+        query = {'timestamp': {
+            '$gte': start.strftime(TIMESTAMP_FORMAT),
+            '$lt': end.strftime(TIMESTAMP_FORMAT)
+        }}
+        if self.group_field is not None:
+            query[self.group_field] = group
+        samples = {}
+        for status in self.raw_collection.find(query):
+            add_values(samples, status)
+        p95 = {
+            f"{field}_p95": summarize(values)['p95']
+            for field, values in samples.items()
+            if values and not isinstance(values[0], list)
+        }
+        if p95:
+            self.collections[tier].update_one(self.bucket(start, group), {'$set': p95})
+
+    def add_sample(self, status):
+        timestamp = datetime.strptime(status['timestamp'], TIMESTAMP_FORMAT)
+        group = status.get(self.group_field) if self.group_field is not None else None
+        update = sample_update(status)
+        for tier, seconds in self.tiers.items():
+            start = bucket_start(timestamp, seconds)
+            try:
+                self.collections[tier].update_one(self.bucket(start, group), update, upsert=True)
+            except DuplicateKeyError:
+                # Another process inserted the bucket between our lookup and insert,
+                # it exists now so the update applies to it
+                self.collections[tier].update_one(self.bucket(start, group), update)
+
+            latest = self.latest_buckets.get((tier, group))
+            if latest is None:
+                # The previous bucket may have closed while the collector was down
+                self.latest_buckets[(tier, group)] = start
+                self.close_bucket(tier, start - timedelta(seconds=seconds), group)
+            elif start > latest:
+                # Every bucket since the last one seen here, other processes may have
+                # written the ones in between
+                self.latest_buckets[(tier, group)] = start
+                query = self.bucket(latest, group)
+                query['timestamp'] = {'$gte': latest.strftime(TIMESTAMP_FORMAT), '$lt': start.strftime(TIMESTAMP_FORMAT)}
+                for document in self.collections[tier].find(query, {'timestamp': 1}):
+                    self.close_bucket(tier, datetime.strptime(document['timestamp'], TIMESTAMP_FORMAT), group)
+            elif start < latest:
+                # Late sample, e.g. replayed from a spool, into a closed bucket
+                self.close_bucket(tier, start, group)
+
+    def add_samples(self, statuses):
+        with self.lock:
+            for status in statuses:
+                self.add_sample(status)
+
+
+def iter_buckets(raw_collection, tiers=ROLLUP_TIERS, group_field=None):
+    # Every bucket of the raw history as (tier, group, document), in one pass
+    open_buckets = {}
+
+    def summarize_open(key):
+        tier, group = key
+        bucket = open_buckets[key]
+        document = summarize_bucket(bucket['start'], bucket['samples'])
+        if group_field is not None:
+            document[group_field] = group
+        return tier, group, document
+
+    for status in raw_collection.find().sort('timestamp', 1):
+        timestamp = datetime.strptime(status['timestamp'], TIMESTAMP_FORMAT)
+        group = status.get(group_field) if group_field is not None else None
+        for tier, seconds in tiers.items():
+            start = bucket_start(timestamp, seconds)
+            bucket = open_buckets.get((tier, group))
+            if bucket is None or bucket['start'] != start:
+                if bucket is not None:
+                    yield summarize_open((tier, group))
+                bucket = {'start': start, 'samples': {}}
+                open_buckets[(tier, group)] = bucket
+            add_values(bucket['samples'], status)
+
+    for key in open_buckets:
+        yield summarize_open(key)
+
+
+def rollup_collections(raw_collection, tiers):
+    return {
+        tier: raw_collection.database[rollup_collection_name(raw_collection.name, tier)]
+        for tier in tiers
+    }
+
+
+def backfill(raw_collection, tiers=ROLLUP_TIERS, group_field=None):
+    # Rebuild every tier from the raw history in one pass, writing each bucket once
+    collections = rollup_collections(raw_collection, tiers)
+    for tier, _, document in iter_buckets(raw_collection, tiers, group_field):
+        collections[tier].replace_one(bucket_filter(document, group_field), document, upsert=True)
+
+
+def check_extremes(raw_collection, tiers=ROLLUP_TIERS, group_field=None):
+    # Stored min and max that differ from the extremes of the bucket's raw samples,
+    # as (tier, bucket, field, stored, expected)
+    collections = rollup_collections(raw_collection, tiers)
+    mismatches = []
+    for tier, _, expected in iter_buckets(raw_collection, tiers, group_field):
+        bucket = bucket_filter(expected, group_field)
+        stored = collections[tier].find_one(bucket) or {}
+        for field, value in expected.items():
+            if field.endswith(('_min', '_max')) and not isinstance(value, list) and stored.get(field) != value:
+                mismatches.append((tier, bucket, field, stored.get(field), value))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from tiny_script import collection
+
+    parser = argparse.ArgumentParser(description="Rebuild or check the rollup tiers of the collector samples")
+    parser.add_argument('--check', action='store_true', help="compare the stored min and max with the raw samples instead")
+    args = parser.parse_args()
+
+    if args.check:
+        mismatches = check_extremes(collection)
+        for tier, bucket, field, stored, expected in mismatches:
+            print(f"{tier} {bucket['timestamp']} {field}: stored {stored}, expected {expected}")
+        print(f"{len(mismatches)} rollup min/max values differ from the raw samples")
+    else:
+        RollupMaintainer(collection).ensure_indexes()
+        backfill(collection)
+        print("Rollup tiers rebuilt from raw samples")
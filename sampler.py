@@ -0,0 +1,98 @@
+import threading
+import time as t
+
+import psutil
+
+# Fields that do not move between samples, the latest value is kept as is
+STATIC_FIELDS = ['ram_total', 'disk_total', 'swap_total', 'uptime']
+
+MIN_SAMPLE_INTERVAL = 0.1  # in seconds
+MAX_SAMPLE_INTERVAL = 1.0  # in seconds
+
+
+def read_sample():
+    # Non-blocking read, cpu_percent(interval=None) reports usage since the previous call
+    virtual_memory = psutil.virtual_memory()
+    disk_usage = psutil.disk_usage('/')
+    swap = psutil.swap_memory()
+    return {
+        "cpu_usage_per_core": psutil.cpu_percent(interval=None, percpu=True),
+        "ram_total": virtual_memory.total,
+        "ram_used": virtual_memory.used,
+        "ram_free": virtual_memory.available,
+        "ram_usage_percent": virtual_memory.percent,
+        "disk_total": disk_usage.total,
+        "disk_used": disk_usage.used,
+        "disk_free": disk_usage.free,
+        "disk_usage_percent": disk_usage.percent,
+        "swap_total": swap.total,
+        "swap_used": swap.used,
+        "swap_free": swap.free,
+        "swap_usage_percent": swap.percent,
+        "uptime": psutil.boot_time()
+    }
+
+
+def aggregate(samples):
+    # The mean keeps the field's own name so readers of the old documents still work,
+    # min and max go to <field>_min and <field>_max, which rollup.py folds into the
+    # min and max of its buckets
+    last = samples[-1]
+    window = {}
+    for field, value in last.items():
+        if field in STATIC_FIELDS:
+            window[field] = value
+        elif isinstance(value, list):
+            per_core = list(zip(*(sample[field] for sample in samples)))
+            window[field] = [sum(core) / len(core) for core in per_core]
+            window[f"{field}_min"] = [min(core) for core in per_core]
+            window[f"{field}_max"] = [max(core) for core in per_core]
+        else:
+            values = [sample[field] for sample in samples]
+            window[field] = sum(values) / len(values)
+            window[f"{field}_min"] = min(values)
+            window[f"{field}_max"] = max(values)
+    window["sample_count"] = len(samples)
+    return window
+
+
+class MetricSampler:
+    """Reads CPU, memory, disk and swap every interval seconds in a background thread
+    and hands out min/max/mean aggregates of everything read since the last drain."""
+
+    def __init__(self, interval=0.25):
+        self.interval = min(max(interval, MIN_SAMPLE_INTERVAL), MAX_SAMPLE_INTERVAL)
+        self.samples = []
+        self.lock = threading.Lock()
+        self.should_stop = False
+
+        # The first cpu_percent call has nothing to compare against, discard it
+        psutil.cpu_percent(interval=None, percpu=True)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        next_read = t.monotonic()
+        while not self.should_stop:
+            next_read += self.interval
+            t.sleep(max(next_read - t.monotonic(), 0))
+            try:
+                sample = read_sample()
+            except Exception as e:
+                print(f'There was an issue reading system metrics: {e}')
+                continue
+            with self.lock:
+                self.samples.append(sample)
+
+    def drain(self):
+        # Aggregate of the current window, None if nothing was read yet
+        with self.lock:
+            samples, self.samples = self.samples, []
+        if not samples:
+            return None
+        return aggregate(samples)
+
+    def stop(self):
+        self.should_stop = True
+        self.thread.join()
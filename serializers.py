@@ -0,0 +1,65 @@
+import datetime
+import json
+from collections.abc import Mapping
+
+import bson
+from bson import Decimal128, ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    # Optional accelerated encoder, the standard json module is used without it
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoding of MongoDB documents in a single pass: BSON types are converted by
+# the encoder's default hook as it meets them, instead of copying every document
+# into plain Python types first.
+
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def bson_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return str(value)
+    if isinstance(value, RawBSONDocument):
+        # Decoded here, while being encoded, in one C call for the whole document
+        return bson.decode(value.raw)
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_json(value):
+    # UTF-8 encoded JSON, ready to be written to a response
+    if orjson is not None:
+        return orjson.dumps(value, default=bson_default)
+    return json.dumps(value, default=bson_default, separators=(',', ':')).encode()
+
+
+def decode_raw_batch(data):
+    # Documents of a concatenated BSON batch, each one decoded only when a field of
+    # it is read. Raw documents are inserted as they are, without being re-encoded.
+    return bson.decode_all(data, RAW_CODEC_OPTIONS)
+
+
+class BsonJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding responses with to_json, so jsonify accepts
+    documents straight from a cursor. Install with app.json = BsonJSONProvider(app)."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return json.dumps(obj, default=bson_default, **kwargs)
+        return to_json(obj).decode()
+
+    def response(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError("jsonify() behavior undefined when passed both args and kwargs")
+        obj = args[0] if len(args) == 1 else (args or kwargs)
+        return self._app.response_class(to_json(obj), mimetype=self.mimetype)
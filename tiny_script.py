@@ -1,21 +1,72 @@
 import psutil
-import json
+import os
+import socket
 import time as t
 import schedule
 from datetime import datetime
 from pymongo import MongoClient
 
+from anomaly import AnomalyDetector
+from cpu_columns import to_columnar
+from metric_log import MetricLogWriter
+from metric_writer import BufferedMetricWriter
+from rollup import RollupMaintainer
+from sampler import MetricSampler
+
 # MongoDB connection details
 MONGO_URI = "mongodb://localhost:27017/"  # Change this if your MongoDB server is running on a different host/port
 DB_NAME = "test_ressource"
 COLLECTION_NAME = "ram"
+ALERTS_COLLECTION_NAME = "alerts"
+HOST_ID = os.environ.get('HOST_ID', socket.gethostname())  # Tags every sample with the machine it came from
+
+# Sampling, metrics are read every SAMPLE_INTERVAL seconds (0.1 to 1) and stored as
+# min/max/mean once per PERSIST_INTERVAL_MINUTES. Set SAMPLE_INTERVAL to None to take a
+# single blocking reading per persisted interval instead.
+SAMPLE_INTERVAL = 0.25
+PERSIST_INTERVAL_MINUTES = 1
+
+# Local history, an append-only binary log (see metric_log.py, which also converts
+# the old system_status.json)
+LOCAL_LOG_PATH = "system_status.bin"
+
+# Write buffering, samples are spooled locally while MongoDB is unreachable
+SPOOL_PATH = "system_status.spool"
+WRITE_BATCH_SIZE = 10
+WRITE_FLUSH_INTERVAL = 5  # in seconds
 
 # Connect to MongoDB
 client = MongoClient(MONGO_URI)
 db = client[DB_NAME]
 collection = db[COLLECTION_NAME]
 
+# Keeps the min/mean/max/p95 tiers next to the raw samples
+rollups = RollupMaintainer(collection)
+
+# Threshold, z-score and EWMA alerts over the stored samples
+anomalies = AnomalyDetector(db[ALERTS_COLLECTION_NAME], COLLECTION_NAME)
+
+local_log = MetricLogWriter(LOCAL_LOG_PATH)
+
+# Samples are written in the background so database latency never delays sampling,
+# the rollups and alerts are updated once their samples are stored
+writer = BufferedMetricWriter(
+    collection,
+    SPOOL_PATH,
+    batch_size=WRITE_BATCH_SIZE,
+    flush_interval=WRITE_FLUSH_INTERVAL,
+    listeners=[rollups.add_samples, anomalies.add_samples]
+)
+
+# Background sampler feeding get_system_status, started with the collector
+sampler = None
+
 def get_system_status():
+    # Aggregate of the high-frequency samples read since the previous call
+    window = sampler.drain() if sampler is not None else None
+    if window is not None:
+        return {"timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "host": HOST_ID, **window}
+
     # Get CPU usage
     cpu_usage = psutil.cpu_percent(interval=1, percpu=True)
 
@@ -46,6 +97,7 @@ def get_system_status():
     # Prepare status report
     status = {
         "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "host": HOST_ID,
         "cpu_usage_per_core": cpu_usage,
         "ram_total": ram_total,
         "ram_used": ram_used,
@@ -78,7 +130,10 @@ def display_system_status():
     print(f"Timestamp: {status['timestamp']}")
     print("CPU Usage Per Core:")
     for i, usage in enumerate(status['cpu_usage_per_core']):
-        print(f"Core {i}: {usage}%")
+        if 'cpu_usage_per_core_max' in status:
+            print(f"Core {i}: {usage:.1f}% (max {status['cpu_usage_per_core_max'][i]}%)")
+        else:
+            print(f"Core {i}: {usage}%")
 
     print("\nRAM Usage:")
     print(f"Total: {bytes_to_human_readable(status['ram_total'])}")
@@ -101,20 +156,36 @@ def display_system_status():
     print("\nSystem Uptime:")
     print(f"Uptime: {datetime.fromtimestamp(status['uptime']).strftime('%Y-%m-%d %H:%M:%S')}")
 
-    # Save the status to a JSON file
-    with open('system_status.json', 'a') as f:
-        json.dump(status, f, indent=4, default=str)
-        f.write('\n')
+    # Per-core CPU is stored as one numeric field per core
+    document = to_columnar(status)
 
-    # Save the status to MongoDB
-    collection.insert_one(status)
-    print("Status saved to MongoDB")
+    # Save the status to the local binary log
+    local_log.append(document)
+
+    # Queue the status for MongoDB
+    writer.write(document)
+    print("Status queued for MongoDB")
 
 if __name__ == "__main__":
-    # Schedule the display_system_status function to run every 1 minute
-    schedule.every(1).minutes.do(display_system_status)
+    # Index the sample timestamp so the dashboard can query time ranges without a full scan
+    collection.create_index('timestamp')
+    rollups.ensure_indexes()
+    anomalies.ensure_indexes()
+
+    # Start reading metrics in the background between two persisted intervals
+    if SAMPLE_INTERVAL is not None:
+        sampler = MetricSampler(SAMPLE_INTERVAL)
+
+    # Schedule the display_system_status function to run every persisted interval
+    schedule.every(PERSIST_INTERVAL_MINUTES).minutes.do(display_system_status)
 
     # Keep the script running
-    while True:
-        schedule.run_pending()
-        t.sleep(1)
+    try:
+        while True:
+            schedule.run_pending()
+            t.sleep(1)
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        # Flush the buffered samples, or spool them if MongoDB is down
+        writer.close()